@@ -0,0 +1,534 @@
+import os
+import csv
+import time
+import argparse
+import functools
+import collections
+import multiprocessing
+from alignment_io import iter_alignment_file, iter_sam_range, read_sam_header, sam_chunks, is_bam
+from pipeline_stages import extract_align_info
+from stage_metrics import StageMetrics
+from result_cache import ResultCache
+
+try:
+    import numpy as np
+    from cigar_arrays import REASONS, decode_cigars, walk_gaps
+except ImportError:
+    # without numpy every read is walked on its own
+    np = None
+
+parser = argparse.ArgumentParser('Extract the junction coordinates of gapped-reads with any number of gaps for each segment in each cell/sample from sam file in a single pass. One output file is written per number of gaps (DI1N_DI_records.csv, DI2N_DI_records.csv, ...). Note: the given boundaries are corresponding to the last base at the 3prime end of the first proportion of the gapped reads and the 5prime end of the last proportion of the gapped reads.')
+
+parser.add_argument(
+    'files', nargs='+', help='input sam or bam file for each cell')
+parser.add_argument(
+    '-r', '--ref', required=True, help='a list of ref sequence id text file (e.g., PR8_ref_seq_id.txt)')
+parser.add_argument(
+    '-m', '--min_length', required=True, type=int, help='the minimum length of parts of reads mapped to 5 and 3 end separately')
+parser.add_argument(
+    '-sl', '--skip_length', required=True, type=int, help='the minimum length of the skip region in cigar')
+parser.add_argument(
+    '-od', '--output_dir', required=True, help='the directory for all the output files')
+parser.add_argument(
+    '-n', '--max_gaps', type=int, default=None, help='only report gapped-reads with up to this number of gaps (default: all)')
+parser.add_argument(
+    '-j', '--jobs', type=int, default=1, help='the number of input files processed in parallel (default: 1)')
+parser.add_argument(
+    '-cs', '--chunk_size', type=int, default=64, help='with more than one job, sam files larger than this many MB are split into chunks of this size that are parsed in parallel (default: 64)')
+parser.add_argument(
+    '--di_ratio', action='store_true', help='also count, per sample and segment, the DI junction reads, the reads without a gap and the depth 30 bases inside either terminus, and write them with the DI ratio (junction reads over both kinds of reads) to DI_ratio.txt (needs numpy)')
+parser.add_argument(
+    '--cache_dir', help='keep the result of every input file in this directory and reuse it on later runs with the same file and options, so that only new or changed files are parsed (default: no cache)')
+parser.add_argument(
+    '--cache_hash', action='store_true', help='recognise unchanged files in the cache by a hash of their contents instead of their size and modification time')
+parser.add_argument(
+    '-f', '--format', choices=('csv', 'npy', 'mtx'), default='csv', help='csv files, or one directory of .npy columns per number of gaps (DI1N_DI_records/, ...) with integer coordinates, dictionary-encoded samples, segments and indel features, and ragged indel lengths, or instead of the reads one sparse samples x junctions count matrix per number of gaps in MatrixMarket format (DI1N_junctions.mtx, ...) with its row and column index files (DI1N_junctions.samples.txt and DI1N_junctions.junctions.txt) (default: csv)')
+
+ORDINALS = ['first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth', 'tenth']
+
+# gap numbers that always get an output file, even when no read has that many gaps
+DEFAULT_GAPS = (1, 2, 3, 4)
+
+OUTPUT_NAME = 'DI%iN_DI_records.csv'
+METRICS_NAME = 'DI_boundary_metrics.json'
+RATIO_NAME = 'DI_ratio.txt'
+COLUMNAR_NAME = 'DI%iN_DI_records'
+MATRIX_NAME = 'DI%iN_junctions'
+
+WRITE_BUFFER = 1 << 20
+
+# the number of alignments whose CIGARs are decoded and checked together (see cigar_arrays.py)
+BATCH_SIZE = 4096
+
+# part of every result cache key; to be increased whenever a change to the parsing changes the records of a file
+RESULT_VERSION = 1
+
+
+def ordinal(i):
+    if i < len(ORDINALS):
+        return ORDINALS[i]
+    return '%ith' % (i + 1)
+
+
+def record_width(n_gaps):
+    # segment, readid, 2 coordinates per gap, d_feature, d_len, i_feature, i_len
+    return 2 + 2 * n_gaps + 4
+
+
+def read_segments(path):
+    segments = set()
+    with open(path) as f:
+        for line in f:
+            segments.add(line.rstrip('\r\n'))
+    return segments
+
+
+def walk_cigar(sposition1, cigar):
+    # split the aligned part of a read into M blocks separated by N gaps; D and I are only allowed between two Ms
+    # and soft-clipping only at either end. Each block is (ref start, ref stop, M length, D lengths, I lengths).
+    ops = cigar['cha']
+    lens = cigar['len']
+    first, last = 0, len(ops)
+    if last and ops[0] == 'S':
+        first = 1
+    if last > first and ops[-1] == 'S':
+        last -= 1
+
+    blocks = []
+    skips = []
+    ref = sposition1
+    start, mlen, dels, ins = ref, 0, [], []
+    prev = None
+    for k in range(first, last):
+        op = ops[k]
+        n = lens[k]
+        if op == 'M':
+            mlen += n
+            ref += n
+        elif op == 'D' and prev == 'M':
+            dels.append(n)
+            ref += n
+        elif op == 'I' and prev == 'M':
+            ins.append(n)
+        elif op == 'N' and prev == 'M':
+            blocks.append((start, ref - 1, mlen, dels, ins))
+            skips.append(n)
+            ref += n
+            start, mlen, dels, ins = ref, 0, [], []
+        else:
+            return None
+        prev = op
+    if prev != 'M':
+        return None
+    blocks.append((start, ref - 1, mlen, dels, ins))
+    return blocks, skips
+
+
+def indel_feature(kind, blocks, index):
+    # e.g. 1D_secondM, 2D_firstM or 2D_1firstM_1thirdM
+    counts = [(len(block[index]), ordinal(i)) for i, block in enumerate(blocks) if block[index]]
+    if not counts:
+        return None, None
+    total = sum(c for c, _ in counts)
+    if len(counts) == 1:
+        feature = '%i%s_%sM' % (total, kind, counts[0][1])
+    else:
+        feature = '%i%s_%s' % (total, kind, '_'.join('%i%sM' % c for c in counts))
+    return feature, [n for block in blocks for n in block[index]]
+
+
+def rejection(walked, min_length, skip_length):
+    # why dip_filter_record() drops a read (see stage_metrics.py), or None
+    if walked is None:
+        return 'pattern_not_handled'
+    blocks, skips = walked
+    if not skips:
+        return 'no_gap'
+    # filter reads based on the length of parts of mapped reads
+    for block in blocks:
+        if block[2] < min_length:
+            return 'below_min_length'
+    # filter reads based on the length of the skipped regions
+    for skip in skips:
+        if skip < skip_length:
+            return 'below_skip_length'
+    return None
+
+
+def dip_filter_record(split_line, sposition1, cigar, min_length, skip_length, counts=None):
+    walked = walk_cigar(sposition1, cigar)
+    reason = rejection(walked, min_length, skip_length)
+    if reason is not None:
+        if counts is not None:
+            counts[reason] += 1
+        return None
+    blocks, skips = walked
+
+    readid = split_line[0]
+    segment = split_line[2]
+    coordinates = [blocks[0][1]]
+    for block in blocks[1:-1]:
+        coordinates.extend(block[:2])
+    coordinates.append(blocks[-1][0])
+    d_feature, d_len = indel_feature('D', blocks, 3)
+    i_feature, i_len = indel_feature('I', blocks, 4)
+    dip_filtered_boundary = (segment, readid) + tuple(coordinates) + (d_feature, d_len, i_feature, i_len)
+    return len(skips), dip_filtered_boundary
+
+
+def filter_batch(batch, min_length, skip_length, counts):
+    # dip_filter_record() for a list of split_lines, with the CIGARs decoded and checked as arrays. Reads without D or I
+    # get their records straight from the arrays; the few with D or I are walked on their own for the indel features.
+    codes, lens, offsets = decode_cigars([split_line[5] for split_line in batch])
+    positions = np.array([int(split_line[3]) for split_line in batch], np.int64)
+    reasons, n_gaps, indel, coordinates = walk_gaps(codes, lens, offsets, positions, min_length, skip_length)
+    coordinates = coordinates.tolist()
+    filtered = []
+    start = 0
+    for split_line, reason, n, has_indel in zip(batch, reasons.tolist(), n_gaps.tolist(), indel.tolist()):
+        stop = start + 2 * n
+        if reason:
+            counts[REASONS[reason]] += 1
+            filtered.append(None)
+        elif has_indel:
+            sposition1, cigar = extract_align_info(split_line)
+            filtered.append(dip_filter_record(split_line, sposition1, cigar, min_length, skip_length, counts))
+        else:
+            row = (split_line[2], split_line[0]) + tuple(coordinates[start:stop]) + (None, None, None, None)
+            filtered.append((n, row))
+        start = stop
+    return filtered
+
+
+def extract_junctions(alignments, segments, min_length, skip_length, n_gaps=None, counts=None):
+    # yields (number of gaps, boundary) for every split read on one of the segments that passes dip_filter_record(),
+    # boundary being the record of dip_filter_record() without the sample id. counts, if given, gets the scanned,
+    # parsed and kept alignments and the reasons for dropping the others
+    if counts is None:
+        counts = collections.Counter()
+
+    def reported(filtered):
+        for record in filtered:
+            if record is None:
+                continue
+            if n_gaps is None or record[0] in n_gaps:
+                counts['kept'] += 1
+                yield record
+            else:
+                counts['gap_count_not_reported'] += 1
+
+    batch = []
+    for _, split_line in alignments:
+        if split_line is None:
+            continue
+        counts['scanned'] += 1
+        if split_line[2] not in segments:
+            counts['off_target_contig'] += 1
+            continue
+        counts['parsed'] += 1
+        if np is None:
+            sposition1, cigar = extract_align_info(split_line)
+            filtered = [dip_filter_record(split_line, sposition1, cigar, min_length, skip_length, counts)]
+        else:
+            batch.append(split_line)
+            if len(batch) < BATCH_SIZE:
+                continue
+            filtered = filter_batch(batch, min_length, skip_length, counts)
+            batch = []
+        for record in reported(filtered):
+            yield record
+    for record in reported(filter_batch(batch, min_length, skip_length, counts) if batch else ()):
+        yield record
+
+
+def scan_alignments(alignments, sid, segments, min_length, skip_length, n_gaps=None, counts=None, matrix=False):
+    # the records of extract_junctions() by number of gaps, with the sample id in front, or with matrix only their
+    # counts per junction as a junction_matrix.JunctionTally
+    if counts is None:
+        counts = collections.Counter()
+    scanned = counts['scanned']
+    junctions = extract_junctions(alignments, segments, min_length, skip_length, n_gaps, counts)
+    if matrix:
+        from junction_matrix import JunctionTally
+        records = JunctionTally(segments)
+        for n, boundary in junctions:
+            records.add(n, boundary)
+    else:
+        records = {}
+        for n, boundary in junctions:
+            records.setdefault(n, []).append((sid,) + boundary)
+    # records is None when there was no alignment at all (header-only file)
+    if counts['scanned'] == scanned:
+        return None
+    return records
+
+
+def segment_counter(segments, min_length, skip_length, di_ratio):
+    # the di_ratio.SegmentCounts for process_file() and process_chunk(), or None
+    if not di_ratio:
+        return None
+    from di_ratio import SegmentCounts
+    return SegmentCounts(segments, min_length, skip_length)
+
+
+def process_file(file_, segments, min_length, skip_length, n_gaps=None, di_ratio=False, matrix=False):
+    # (sid, records, (file_, counts, seconds)), plus the di_ratio.SegmentCounts of the file with di_ratio; with matrix
+    # records is a junction_matrix.JunctionTally (see scan_alignments())
+    start = time.time()
+    sid = os.path.basename(file_).split('.')[0]
+    counts = collections.Counter()
+    segment_counts = segment_counter(segments, min_length, skip_length, di_ratio)
+    alignments = iter_alignment_file(file_)
+    if segment_counts:
+        from di_ratio import count_segments
+        alignments = count_segments(alignments, segment_counts)
+    records = scan_alignments(alignments, sid, segments, min_length, skip_length, n_gaps, counts, matrix)
+    if segment_counts:
+        segment_counts.flush()
+        return sid, records, (file_, counts, time.time() - start), segment_counts
+    return sid, records, (file_, counts, time.time() - start)
+
+
+def process_chunk(file_, start, end, segments, min_length, skip_length, n_gaps=None, di_ratio=False, matrix=False):
+    started = time.time()
+    sid = os.path.basename(file_).split('.')[0]
+    counts = collections.Counter()
+    segment_counts = segment_counter(segments, min_length, skip_length, di_ratio)
+    alignments = iter_sam_range(file_, start, end)
+    if segment_counts:
+        from di_ratio import count_segments
+        # the segment lengths come from the header, which is not part of any chunk
+        for line in read_sam_header(file_)[0]:
+            segment_counts.header(line)
+        alignments = count_segments(alignments, segment_counts)
+    records = scan_alignments(alignments, sid, segments, min_length, skip_length, n_gaps, counts, matrix)
+    if segment_counts:
+        segment_counts.flush()
+        return sid, records, (file_, counts, time.time() - started), segment_counts
+    return sid, records, (file_, counts, time.time() - started)
+
+
+def merge_chunks(processed):
+    sid = processed[0][0]
+    merged = None
+    counts = collections.Counter()
+    seconds = 0
+    segment_counts = None
+    for result in processed:
+        records, (file_, chunk_counts, chunk_seconds) = result[1:3]
+        counts.update(chunk_counts)
+        # the time spent on all chunks of the file, whichever workers they ran on
+        seconds += chunk_seconds
+        if records is None:
+            pass
+        elif merged is None:
+            merged = records
+        elif isinstance(merged, dict):
+            for n, rows in records.items():
+                merged.setdefault(n, []).extend(rows)
+        else:
+            merged.merge(records)
+        if len(result) > 3:
+            if segment_counts is None:
+                segment_counts = result[3]
+            else:
+                segment_counts.merge(result[3])
+    if segment_counts:
+        return sid, merged, (file_, counts, seconds), segment_counts
+    return sid, merged, (file_, counts, seconds)
+
+
+def result_cache(cache_dir, segments, min_length, skip_length, n_gaps=None, content_hash=False, di_ratio=False,
+                 matrix=False):
+    # the ResultCache for process_files() with these options, or None without a cache directory
+    if not cache_dir:
+        return None
+    params = (RESULT_VERSION, sorted(segments), min_length, skip_length, sorted(n_gaps) if n_gaps else None, di_ratio,
+              matrix)
+    return ResultCache(cache_dir, params, content_hash)
+
+
+def cached_result(cache, file_):
+    # the cached result of a file, with the time it took to load as its metrics time
+    start = time.time()
+    result = cache.get(file_)
+    if result is None:
+        return None
+    sid, records, (_, counts, _) = result[:3]
+    print('Using cached result: ' + file_)
+    return (sid, records, (file_, counts, time.time() - start)) + tuple(result[3:])
+
+
+def process_files(files, segments, min_length, skip_length, n_gaps=None, jobs=1, chunk_size=None,
+                  process=process_file, cache=None, di_ratio=False, matrix=False):
+    # yields (sid, records, metrics) file by file in input order, so only the records of the file being written are
+    # held; metrics is (file_, counts, seconds), see stage_metrics.py. With di_ratio the di_ratio.SegmentCounts of the
+    # file comes fourth (see di_ratio.RatioTable.track()). With matrix the records are only counted, see
+    # scan_alignments(); this is what JunctionMatrixWriter takes.
+    # process is called as process(file_, segments, min_length, skip_length, n_gaps, di_ratio=di_ratio, matrix=matrix)
+    # for every file that is not chunked.
+    # With a cache (see result_cache()), files with a stored result are not parsed again and new results are stored.
+    if jobs <= 1:
+        for file_ in files:
+            result = cached_result(cache, file_) if cache else None
+            if result is None:
+                print('Processing file: ' + file_)
+                result = process(file_, segments, min_length, skip_length, n_gaps, di_ratio=di_ratio, matrix=matrix)
+                if cache:
+                    cache.put(file_, result)
+            yield result
+        return
+
+    # a large sam file is split into line-aligned byte ranges so that it is parsed on several cores
+    hits = {}
+    tasks = []
+    for i, file_ in enumerate(files):
+        result = cached_result(cache, file_) if cache else None
+        if result is not None:
+            hits[i] = result
+            continue
+        print('Processing file: ' + file_)
+        size = os.path.getsize(file_)
+        if chunk_size and size > chunk_size and not is_bam(file_):
+            for start, end in sam_chunks(file_, chunk_size):
+                tasks.append((i, end - start, process_chunk,
+                              (file_, start, end, segments, min_length, skip_length, n_gaps, di_ratio, matrix)))
+        else:
+            tasks.append((i, size, functools.partial(process, di_ratio=di_ratio, matrix=matrix),
+                          (file_, segments, min_length, skip_length, n_gaps)))
+
+    # the largest tasks are scheduled first so that a big file does not start last and hold up the whole run; results
+    # are handed on in input order so the output is the same as a serial run
+    order = sorted(range(len(tasks)), key=lambda k: tasks[k][1], reverse=True)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        pending = [None] * len(tasks)
+        for k in order:
+            pending[k] = pool.apply_async(tasks[k][2], tasks[k][3])
+        for i in range(len(files)):
+            if i in hits:
+                yield hits.pop(i)
+                continue
+            merged = merge_chunks([result.get() for task, result in zip(tasks, pending) if task[0] == i])
+            if cache:
+                cache.put(files[i], merged)
+            yield merged
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    return value
+
+
+class RecordWriter(object):
+    # one csv per number of gaps, laid out like pandas' DataFrame.to_csv (column numbers as header and a running row
+    # index), written as the records come in. Files are opened for the given gap numbers up front and, if output_name
+    # is set, for any other number of gaps the first time a read with that many gaps shows up.
+
+    def __init__(self, segments, outputs, output_name=None):
+        self.segments = segments
+        self.output_name = output_name
+        self._files = {}
+        self._writers = {}
+        self._rows = {}
+        self._empty = []
+        for n in sorted(outputs):
+            self._open(n, outputs[n])
+
+    def _open(self, n, path):
+        f = open(path, 'w', WRITE_BUFFER)
+        self._files[n] = f
+        self._writers[n] = csv.writer(f, lineterminator='\n')
+        self._writers[n].writerow([''] + list(range(record_width(n) + 1)))
+        self._rows[n] = 0
+        # files without any alignment seen before this output was opened still get their placeholder rows
+        for sid in self._empty:
+            self._write_placeholders(n, sid)
+
+    def _write(self, n, row):
+        self._writers[n].writerow([self._rows[n]] + [csv_value(value) for value in row])
+        self._rows[n] += 1
+
+    def _write_placeholders(self, n, sid):
+        placeholder = (None,) * (record_width(n) - 1)
+        for segment in sorted(self.segments):
+            self._write(n, (sid, segment) + placeholder)
+
+    def add(self, sid, records):
+        if records is None:
+            self._empty.append(sid)
+            for n in sorted(self._writers):
+                self._write_placeholders(n, sid)
+            return
+        for n in sorted(records):
+            if n not in self._writers:
+                self._open(n, self.output_name % n)
+            for row in records[n]:
+                self._write(n, row)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+
+def write_records(processed, segments, outputs, output_name=None, writer_class=RecordWriter):
+    # processed yields (sid, records), e.g. StageMetrics.track() of process_files()
+    writer = writer_class(segments, outputs, output_name)
+    try:
+        for sid, records in processed:
+            writer.add(sid, records)
+    finally:
+        writer.close()
+
+
+def record_outputs(output_dir, format_='csv', n_gaps=None):
+    # outputs, output_name and writer_class for write_records()
+    if format_ == 'npy':
+        from columnar_records import ColumnarWriter
+        output_name = os.path.join(output_dir, COLUMNAR_NAME)
+        writer_class = ColumnarWriter
+    elif format_ == 'mtx':
+        from junction_matrix import JunctionMatrixWriter
+        output_name = os.path.join(output_dir, MATRIX_NAME)
+        writer_class = JunctionMatrixWriter
+    else:
+        output_name = os.path.join(output_dir, OUTPUT_NAME)
+        writer_class = RecordWriter
+    return dict((n, output_name % n) for n in n_gaps or DEFAULT_GAPS), output_name, writer_class
+
+
+def main():
+    args = parser.parse_args()
+    segments = read_segments(args.ref)
+    n_gaps = None
+    if args.max_gaps is not None:
+        n_gaps = set(range(1, args.max_gaps + 1))
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    # the junction matrix only needs the read count of every junction, which the workers count as they scan
+    matrix = args.format == 'mtx'
+    metrics = StageMetrics('DI_boundary_characterization_engine')
+    cache = result_cache(args.cache_dir, segments, args.min_length, args.skip_length, n_gaps, args.cache_hash,
+                         args.di_ratio, matrix)
+    processed = process_files(args.files, segments, args.min_length, args.skip_length, n_gaps, args.jobs,
+                              args.chunk_size << 20, cache=cache, di_ratio=args.di_ratio, matrix=matrix)
+    ratios = None
+    if args.di_ratio:
+        from di_ratio import RatioTable
+        ratios = RatioTable()
+        processed = ratios.track(processed)
+    write_records(metrics.track(processed), segments, *record_outputs(args.output_dir, args.format, n_gaps))
+    metrics.write(os.path.join(args.output_dir, METRICS_NAME))
+    if ratios:
+        ratios.write(os.path.join(args.output_dir, RATIO_NAME))
+
+
+if __name__ == '__main__':
+    main()
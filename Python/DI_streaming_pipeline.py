@@ -0,0 +1,177 @@
+import os
+import time
+import argparse
+import functools
+import collections
+from alignment_io import iter_alignment_file, iter_bam_references, is_bam, find_bai
+from pipeline_stages import (read_fasta_ids, read_fasta_lengths, read_cds, read_patterns, filter_contigs, filter_mapq, fetch_split_reads,
+                             write_sam)
+from stage_metrics import StageMetrics, count_alignments
+from DI_boundary_characterization_engine import (read_segments, scan_alignments, process_files, write_records,
+                                                 record_outputs, RATIO_NAME)
+
+parser = argparse.ArgumentParser('Run the viral read extraction (filter_IAV_sam.py), the MAPQ filtering (map_qual_filter_forSTARoutput_IAV_sam.py), the split-read fetch (Viral_vRNA_split_reads_alignment_sam_fetch_v5_04092020.py) and the DI boundary extraction (DI_boundary_characterization_engine.py) as one streaming pass over each STAR alignment file. The intermediate sam files are only written when their output directory is given.')
+
+parser.add_argument(
+    'files', nargs='+', help='input sam or bam file for each cell (e.g., *.Aligned.out.sorted.bam)')
+parser.add_argument(
+    '-g', '--reference_genome', required=True, help='IAV reference genomes in fasta format')
+parser.add_argument(
+    '--ref_CDS_position', required=True, help='reference sequence coding region positions (e.g., PR8_ref_gene_info.txt)')
+parser.add_argument(
+    '-r', '--ref', required=True, help='a list of ref sequence id text file (e.g., PR8_ref_seq_id.txt)')
+parser.add_argument(
+    '-m', '--min_length', required=True, type=int, help='the minimum length of parts of reads mapped to 5 and 3 end separately')
+parser.add_argument(
+    '-sl', '--skip_length', required=True, type=int, help='the minimum length of the skip region in cigar')
+parser.add_argument(
+    '-od', '--output_dir', required=True, help='the directory for the DI boundary output files')
+parser.add_argument(
+    '--patterns', help='optional file of the CIGAR patterns to keep, one per line (e.g., MNMDM); by default every pattern with at least one N is kept')
+parser.add_argument(
+    '--use_index', action='store_true', help='for coordinate-sorted bam files with a .bai index, seek straight to the IAV reference sequences instead of scanning every alignment')
+parser.add_argument(
+    '-n', '--max_gaps', type=int, default=None, help='only report gapped-reads with up to this number of gaps (default: all)')
+parser.add_argument(
+    '-j', '--jobs', type=int, default=1, help='the number of input files processed in parallel (default: 1)')
+parser.add_argument(
+    '-f', '--format', choices=('csv', 'npy', 'mtx'), default='csv', help='format of the DI boundary output, see DI_boundary_characterization_engine.py (default: csv)')
+parser.add_argument(
+    '--iav_sam_dir', help='also write the viral alignments of each cell here (output of filter_IAV_sam.py)')
+parser.add_argument(
+    '--qualfiltered_sam_dir', help='also write the MAPQ-filtered viral alignments here (output of map_qual_filter_forSTARoutput_IAV_sam.py)')
+parser.add_argument(
+    '--dedup', action='store_true', help='remove duplicate reads after the MAPQ filtering, like Picard MarkDuplicates REMOVE_DUPLICATES=true (see remove_duplicates_sam.py); the input has to be coordinate-sorted')
+parser.add_argument(
+    '--dedup_sam_dir', help='with --dedup, also write the deduplicated alignments here (output of remove_duplicates_sam.py)')
+parser.add_argument(
+    '--gapped_sam_dir', help='also write the split-read alignments here (output of Viral_vRNA_split_reads_alignment_sam_fetch_v5_04092020.py)')
+parser.add_argument(
+    '--coverage', help='also count the per-base depth of the MAPQ-filtered (and, with --dedup, deduplicated) viral alignments, like bedtools genomecov -d -split, into <coverage>.npy with <coverage>.samples.txt and <coverage>.segments.txt (see viral_coverage.py; needs numpy)')
+parser.add_argument(
+    '--feature_counts', help='also count the read pairs of every gene in --annotation among the MAPQ-filtered (and deduplicated) alignments, like featureCounts -p -B -C -t exon -g gene_id, into this featureCounts-style table and its .summary (see viral_feature_counts.py)')
+parser.add_argument(
+    '--annotation', help='gene annotation in GTF format for --feature_counts (e.g., H1N1_PR8_8segs_genes_annotation_full_02032020.gtf)')
+parser.add_argument(
+    '--di_ratio', action='store_true', help='also count, per cell and segment, the DI junction reads and the reads without a gap among the MAPQ-filtered (and deduplicated) alignments, and the depth 30 bases inside either terminus, and write them with the DI ratio (junction reads over both kinds of reads) to DI_ratio.txt (see di_ratio.py; needs numpy)')
+
+
+def sample_id(file_):
+    # the cell id the chained scripts end up with: filter_IAV_sam.py cuts at the first '-', the later ones at the
+    # first '.'
+    return os.path.basename(file_).split('-')[0].split('.')[0]
+
+
+def process_sample(file_, segments, min_length, skip_length, n_gaps=None, fasta_ids=None, cds=None, patterns=None,
+                   use_index=False, sam_dirs=(None, None, None, None), coverage=None, di_ratio=False, dedup=False,
+                   feature_counts=None, matrix=False):
+    # (sid, records, (file_, counts, seconds)) like process_file() of the boundary engine (also for matrix), counting
+    # over the whole chain. coverage is (path, files, fasta segments): the depth goes into the row of file_ in files of
+    # viral_coverage output. feature_counts is (path, files, viral_feature_counts.FeatureIndex): the gene counts of
+    # file_ go into its part of the viral_feature_counts output.
+    # With di_ratio the di_ratio.SegmentCounts of the MAPQ-filtered (and deduplicated) alignments comes fourth.
+    start = time.time()
+    sid = sample_id(file_)
+    counts = collections.Counter()
+    if use_index and is_bam(file_) and find_bai(file_):
+        alignments = iter_bam_references(file_, fasta_ids)
+    else:
+        alignments = iter_alignment_file(file_)
+    alignments = count_alignments(alignments, counts, 'scanned')
+    depth = segment_counts = genes = None
+    if coverage:
+        from viral_coverage import Coverage, count_coverage, write_depth
+        depth = Coverage(coverage[2])
+    if di_ratio:
+        from di_ratio import SegmentCounts, count_segments
+        segment_counts = SegmentCounts(segments, min_length, skip_length)
+    if feature_counts:
+        from viral_feature_counts import FeatureCounts, count_features, write_part
+        genes = FeatureCounts(feature_counts[2])
+
+    def deduplicated(alignments):
+        # the coverage, DI ratio and gene counters see the same alignments as map_qual_filter_forSTARoutput_IAV_sam.py,
+        # or as remove_duplicates_sam.py with dedup
+        if dedup:
+            from remove_duplicates_sam import remove_duplicates
+            alignments = remove_duplicates(alignments, counts=counts)
+        if depth:
+            alignments = count_coverage(alignments, depth)
+        if segment_counts:
+            alignments = count_segments(alignments, segment_counts)
+        if genes:
+            alignments = count_features(alignments, genes)
+        return alignments
+
+    stages = [functools.partial(filter_contigs, fasta_ids=fasta_ids, counts=counts),
+              functools.partial(filter_mapq, counts=counts),
+              deduplicated,
+              functools.partial(fetch_split_reads, cds=cds, patterns=patterns, counts=counts)]
+    for stage, sam_dir in zip(stages, sam_dirs):
+        alignments = stage(alignments)
+        if sam_dir:
+            alignments = write_sam(alignments, os.path.join(sam_dir, '%s.sam' % sid))
+    # the split reads were already scanned and parsed by fetch_split_reads(), only the reasons and kept are added
+    scan_counts = collections.Counter()
+    records = scan_alignments(alignments, sid, segments, min_length, skip_length, n_gaps, scan_counts, matrix)
+    del scan_counts['scanned'], scan_counts['parsed']
+    counts.update(scan_counts)
+    if coverage:
+        write_depth(coverage[0], coverage[1].index(file_), depth.depth())
+    if feature_counts:
+        write_part(feature_counts[0], feature_counts[1].index(file_), genes.column())
+    if segment_counts:
+        segment_counts.flush()
+        return sid, records, (file_, counts, time.time() - start), segment_counts
+    return sid, records, (file_, counts, time.time() - start)
+
+
+def main():
+    args = parser.parse_args()
+    segments = read_segments(args.ref)
+    n_gaps = None
+    if args.max_gaps is not None:
+        n_gaps = set(range(1, args.max_gaps + 1))
+    patterns = None
+    if args.patterns:
+        patterns = read_patterns(args.patterns)
+
+    coverage = None
+    if args.coverage:
+        from viral_coverage import create_depth
+        fasta_segments = read_fasta_lengths(args.reference_genome)
+        create_depth(args.coverage, [sample_id(file_) for file_ in args.files], fasta_segments)
+        coverage = (args.coverage, args.files, fasta_segments)
+
+    feature_counts = None
+    if args.feature_counts:
+        if not args.annotation:
+            parser.error('--feature_counts needs --annotation')
+        from viral_feature_counts import FeatureIndex, read_gtf, read_parts, write_feature_counts
+        feature_counts = (args.feature_counts, args.files, FeatureIndex(*read_gtf(args.annotation)))
+
+    process = functools.partial(
+        process_sample, fasta_ids=read_fasta_ids(args.reference_genome), cds=read_cds(args.ref_CDS_position),
+        patterns=patterns, use_index=args.use_index,
+        sam_dirs=(args.iav_sam_dir, args.qualfiltered_sam_dir, args.dedup_sam_dir, args.gapped_sam_dir),
+        coverage=coverage, dedup=args.dedup, feature_counts=feature_counts)
+    # every file goes through the whole chain in one task, so files are never split into chunks here
+    metrics = StageMetrics('DI_streaming_pipeline')
+    processed = process_files(args.files, segments, args.min_length, args.skip_length, n_gaps, args.jobs,
+                              process=process, di_ratio=args.di_ratio, matrix=args.format == 'mtx')
+    ratios = None
+    if args.di_ratio:
+        from di_ratio import RatioTable
+        ratios = RatioTable()
+        processed = ratios.track(processed)
+    write_records(metrics.track(processed), segments, *record_outputs(args.output_dir, args.format, n_gaps))
+    metrics.write(os.path.join(args.output_dir, 'DI_streaming_pipeline.metrics.json'))
+    if ratios:
+        ratios.write(os.path.join(args.output_dir, RATIO_NAME))
+    if feature_counts:
+        write_feature_counts(args.feature_counts, feature_counts[2], args.files,
+                             read_parts(args.feature_counts, len(args.files)))
+
+
+if __name__ == '__main__':
+    main()
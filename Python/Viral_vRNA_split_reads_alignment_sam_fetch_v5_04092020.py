@@ -1,6 +1,11 @@
-import re
+import os
+import time
 import argparse
 import collections
+import multiprocessing
+from alignment_io import iter_alignment_file, iter_sam_range, read_sam_header, sam_chunks, is_bam
+from pipeline_stages import read_cds, read_patterns, is_split_read, fetch_split_reads, write_alignments
+from stage_metrics import StageMetrics, count_alignments
 
 
 parser = argparse.ArgumentParser('Extract all the alignment fallen in the coding seqeunce regions for each viral segment. Note any alignment with any number of Ns will be considered')
@@ -9,533 +14,91 @@ parser.add_argument(
     '--ref_CDS_position', required=True, help='reference sequence coding region positions (e.g., a tab-delimited file containing information such as AF389115.1 28 2307')
 
 parser.add_argument(
-    '--input_sam_file', required=True, help='input sam file')
+    '--input_sam_file', required=True, help='input sam or bam file')
 
 parser.add_argument(
     '--output_sam_file', required=True, help='output sam file')
 
-args = parser.parse_args()
-
-UPPERCASE = re.compile(r'([A-Z])')
-
-PATTERNS = {
-    'MNM',
-    'SMNM',
-    'MNMS',
-    'MNMDM',
-    'SMNMS',
-    'MDMNM',
-    'MNMIM',
-    'MIMNM',
-    'SMDMNM',
-    'MNMDMS',
-    'SMNMDM',
-    'SMNMIM',
-    'SMIMNM',
-    'MDMNMS',
-    'MIMNMS',
-    'MNMIMS',
-    'MDMIMNM',
-    'SMDMNMS',
-    'SMNMIMS',
-    'SMIMNMS',
-    'MDMDMNM',
-    'MNMIMIM',
-    'SMNMDMS',
-    'MNMDMDM',
-    'MNMDMIM',
-    'MIMDMNM',
-    'MIMIMNM',
-    'MNMIMDM',
-    'MDMNMIMS',
-    'SMIMNMDM',
-    'MIMNMIM',
-    'MDMNMIM',
-    'MIMNMDM',
-    'MDMNMDM',
-    'MDMDMNMS',
-    'MNMNM',
-    'MNMNMS',
-    'SMNMNM',
-    'MDMNMNM',
-    'MNMNMNM',
-    'SMNMNMS',
-    'MNMDMNM',
-    'MNMDMNMS',
-    'MNMNMIM',
-    'MNMNMDMS',
-    'MNMNMDM',
-    'MNMNMIMS',
-    'SMNMNMDM',
-    'MIMNMNMS',
-    'SMNMDMNM',
-    'SMDMNMNM',
-    'MNMIMNM',
-    'SMNMDMDM',
-    'SMDMDMNM',
-    'MIMNMNM',
-    'MDMNMDMS',
-    'MDMNMDMNM',
-    'SMDMNMDM',
-    'MDMNMNMS',
-    'SMNMIMNM',
-    'SMIMNMNM',
-    'MDMNMDMNMS',
-    'MNMDMDMS',
-    'SMNMNMNM',
-    'MNMNMNMS',
-    'MNMNMNMDM',
-    'MDMNMNMNM',
-    'MNMNMDMNM',
-    'MNMDMNMNM',
-    'MNMNMNMIM',
-    'MNMNMNMNM',
-    'SMNMNMNMS',
-    'MNMIMDMS',
-    'SMNMIMDM',
-    'SMDMNMNMS',
-    'MDMDMNMNM',
-    'MNMNMDMDM',
-    'MNMDMNMDM',
-    'SMNMNMIM',
-    'SMNMNMDMS',
-    'SMNMDMNMS',
-    'MDMDMDMNM',
-    'SMIMDMNM',
-    'MDMDMNMDM',
-    'MNMDMNMNMS',
-    'SMDMNMIM',
-    'SMDMDMDMNM',
-    'MNMDMDMDM',
-    'SMDMIMNM',
-    'SMNMNMNMNM',
-    'MDMNMDMDM',
-    'MDMNMNMDM',
-    'SMIMNMNMS',
-    'SMNMDMDMS',
-    'SMDMDMNMNM',
-    'SMDMNMDMS',
-    'SMDMDMNMS',
-    'MNMIMNMS',
-    'MDMDMIMNM',
-    'SMNMNMNMDM',
-    'MNMNMIMNM',
-    'MNMDMDMNM',
-    'MNMNMDMDMS',
-    'MNMDMDMNMS',
-    'MNMDMIMNM',
-    'MDMIMNMS',
-    'MNMNMDMDMNM',
-    'MNMIMNMNM',
-    'MNMIMNMDM',
-    'MNMIMDMNM',
-    'SMNMDMDMNM',
-    'MNMDMNMDM',
-    'MIMNMDMDM'
-}
-
-
-def is_header(line):
-    return line.startswith('@')
-
-
-def is_in_range(pattern, cigar, split_line, cds):
-    segment = split_line[2]
-    info = cds[segment]
-    firstbase = int(split_line[3])
-
-    if pattern == 'MNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] - 1
-
-    if pattern == 'SMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] - 1
-
-    if pattern == 'MNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] - 1
-
-    if pattern == 'MNMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] - 1
-
-    if pattern == 'SMNMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] - 1
-
-    if pattern == 'MDMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] - 1
-
-    if pattern == 'MNMIM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] - 1
-
-    if pattern == 'MIMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] - 1
-
-    if pattern == 'SMDMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] - 1
-
-    if pattern == 'MNMDMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] - 1
-
-    if pattern == 'SMNMDM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] - 1
-
-    if pattern == 'SMNMIM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][5] - 1
-
-    if pattern == 'SMIMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] - 1
-
-    if pattern == 'MDMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] - 1
-
-    if pattern == 'MIMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] - 1
-
-    if pattern == 'MNMIMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] - 1
-
-    if pattern == 'MDMIMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'SMDMNMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] - 1
-
-    if pattern == 'SMNMIMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][5] - 1
-
-    if pattern == 'SMIMNMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] - 1
-
-    if pattern == 'MDMDMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMIMIM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] + cigar['len'][6] - 1
-
-    if pattern == 'SMNMDMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] - 1
-
-    if pattern == 'MNMDMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMDMIM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][6] - 1
-
-    if pattern == 'MIMDMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MIMIMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][2] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMIMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MDMNMIMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][6] - 1
-
-    if pattern == 'SMIMNMDM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MIMNMIM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][6] - 1
-
-    if pattern == 'MDMNMIM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][6] - 1
-
-    if pattern == 'MIMNMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MDMNMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MDMDMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] - 1
-
-    if pattern == 'MNMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] - 1
-
-    if pattern == 'SMNMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] - 1
-
-    if pattern == 'MDMNMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMNMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'SMNMNMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] - 1
-
-    if pattern == 'MNMDMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMDMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMNMIM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][6] - 1
-
-    if pattern == 'MNMNMDMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMNMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMNMIMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][6] - 1
-
-    if pattern == 'SMNMNMDM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MIMNMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'SMNMDMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'SMDMNMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MNMIMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'SMNMDMDM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'SMDMDMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MIMNMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MDMNMDMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MDMNMDMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'SMDMNMDM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MDMNMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'SMNMIMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'SMIMNMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MDMNMDMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMDMDMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'SMNMNMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MNMNMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMNMNMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MDMNMNMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMNMDMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMDMNMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMNMNMIM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][8] - 1
-
-    if pattern == 'MNMNMNMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'SMNMNMNMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MNMIMDMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'SMNMIMDM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'SMDMNMNMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MDMDMNMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMNMDMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMDMNMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'SMNMNMIM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][7] - 1
-
-    if pattern == 'SMNMNMDMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'SMNMDMNMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MDMDMDMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'SMIMDMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MDMDMNMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMDMNMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'SMDMNMIM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][7] - 1
-
-    if pattern == 'SMDMDMDMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] + cigar['len'][9] - 1
-
-    if pattern == 'MNMDMDMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'SMDMIMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'SMNMNMNMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] + cigar['len'][9] - 1
-
-    if pattern == 'MDMNMDMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MDMNMNMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'SMIMNMNMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'SMNMDMDMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'SMDMDMNMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] + cigar['len'][9] - 1
-
-    if pattern == 'SMDMNMDMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'SMDMDMNMS':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] - 1
-
-    if pattern == 'MNMIMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MDMDMIMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'SMNMNMNMDM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] + cigar['len'][9] - 1
-
-    if pattern == 'MNMNMIMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMDMDMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMNMDMDMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMDMDMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMDMIMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MDMIMNMS':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] - 1
-
-    if pattern == 'MNMNMDMDMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] + cigar['len'][9] + cigar['len'][10] - 1
-
-    if pattern == 'MNMIMNMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMIMNMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MNMIMDMNM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'SMNMDMDMNM':
-        lastbase = firstbase + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] + cigar['len'][9] - 1
-
-    if pattern == 'MNMDMNMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][1] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    if pattern == 'MIMNMDMDM':
-        lastbase = firstbase + cigar['len'][0] + cigar['len'][2] + cigar['len'][3] + cigar['len'][4] + cigar['len'][5] + cigar['len'][6] + cigar['len'][7] + cigar['len'][8] - 1
-
-    return (info['min'] <= firstbase) and (lastbase <= info['max'])
-
+parser.add_argument(
+    '--patterns', help='optional file of the CIGAR patterns to keep, one per line (e.g., MNMDM); by default every pattern with at least one N is kept')
 
-def extract_align_info(split_line):
-    sposition1 = int(split_line[3])
-    cigar = {'cha': [], 'len': []}
-    last = None
-    for i, s in enumerate(re.split(UPPERCASE, split_line[5])):
-        if s:
-            if i % 2 == 0:
-                last = int(s)
-            else:
-                cigar['cha'].append(s)
-                cigar['len'].append(last)
-    return sposition1, cigar
+parser.add_argument(
+    '-j', '--jobs', type=int, default=1, help='the number of processes used to parse a large input sam file (default: 1)')
 
+parser.add_argument(
+    '-cs', '--chunk_size', type=int, default=64, help='with more than one job, an input sam file larger than this many MB is split into chunks of this size that are parsed in parallel (default: 64)')
 
-def main():
-    cds = {}
-    with open(args.ref_CDS_position) as f:
-        for line in f:
-            split_line = line.split('\t')
-            cds[split_line[0]] = {
-                'min': int(split_line[1]),
-                'max': int(split_line[2])
-            }
 
+def filter_alignments(alignments, cds, patterns, counts=None):
+    # header lines, and the split reads falling in the coding regions grouped by segment
     headers = []
-    with open(args.input_sam_file) as f:
+    segs = collections.defaultdict(list)
+    for line, split_line in alignments:
+        if split_line is None:
+            headers.append(line)
+            continue
+        if counts is not None:
+            counts['scanned'] += 1
+        if is_split_read(split_line, cds, patterns, counts):
+            segs[split_line[2]].append(str(line))
+            if counts is not None:
+                counts['kept'] += 1
+    return headers, segs
+
+
+def fetch_chunk(path, start, end, cds, patterns):
+    counts = collections.Counter()
+    return filter_alignments(iter_sam_range(path, start, end), cds, patterns, counts)[1], counts
+
+
+def fetch_chunks(path, cds, patterns, jobs, chunk_size):
+    headers, _ = read_sam_header(path)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        pending = [pool.apply_async(fetch_chunk, (path, start, end, cds, patterns))
+                   for start, end in sam_chunks(path, chunk_size)]
+        # chunks are concatenated in file order, so each segment keeps the order of the input
         segs = collections.defaultdict(list)
-        for line in f:
-            if not is_header(line):
-                split_line = line.split('\t')
-                segs[split_line[2]].append(split_line)
-            else:
-                headers.append(line)
+        counts = collections.Counter()
+        for result in pending:
+            chunk_segs, chunk_counts = result.get()
+            for seg, lines in chunk_segs.items():
+                segs[seg].extend(lines)
+            counts.update(chunk_counts)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return headers, segs, counts
 
-    segs = collections.OrderedDict(sorted(segs.items(), key=lambda t: t[0]))
-    filtered_segs = collections.OrderedDict()
-    for seg, split_lines in segs.iteritems():
-        filtered_split_lines = []
-        for split_line in split_lines:
-            sposition1, cigar = extract_align_info(split_line)
-            pattern = ''.join(cigar['cha'])
-            if pattern in PATTERNS:
-                if is_in_range(pattern, cigar, split_line, cds):
-                    filtered_split_lines.append(split_line)
-        filtered_segs[seg] = filtered_split_lines
 
-    with open(args.output_sam_file, 'w') as f:
-        f.writelines(headers)
-        for seg, filtered_split_lines in filtered_segs.iteritems():
-            f.writelines(map(lambda x: '\t'.join(x), filtered_split_lines))
+def main():
+    args = parser.parse_args()
+    cds = read_cds(args.ref_CDS_position)
+
+    patterns = None
+    if args.patterns:
+        patterns = read_patterns(args.patterns)
+
+    start = time.time()
+    metrics = StageMetrics('Viral_vRNA_split_reads_alignment_sam_fetch_v5_04092020')
+    chunk_size = args.chunk_size << 20
+    if args.jobs > 1 and chunk_size and os.path.getsize(args.input_sam_file) > chunk_size and not is_bam(args.input_sam_file):
+        headers, segs, counts = fetch_chunks(args.input_sam_file, cds, patterns, args.jobs, chunk_size)
+        with open(args.output_sam_file, 'w') as f:
+            f.writelines(headers)
+            for seg in sorted(segs):
+                f.writelines(segs[seg])
+    else:
+        # one pass over the input; see fetch_split_reads() for how coordinate-sorted input is streamed
+        counts = collections.Counter()
+        alignments = count_alignments(iter_alignment_file(args.input_sam_file), counts, 'scanned')
+        alignments = fetch_split_reads(alignments, cds, patterns, counts)
+        write_alignments(count_alignments(alignments, counts, 'kept'), args.output_sam_file)
+    metrics.add_file(args.input_sam_file, counts, time.time() - start)
+    metrics.write(args.output_sam_file + '.metrics.json')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,325 @@
+import os
+import struct
+import zlib
+
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+BAM_MAGIC = b'BAM\x01'
+BAI_MAGIC = b'BAI\x01'
+
+# pseudo-bin holding the per-reference mapped/unmapped counts in a .bai
+BAI_PSEUDO_BIN = 37450
+
+CIGAR_OPS = 'MIDNSHP=X'
+SEQ_PAIRS = ['=ACMGRSVTWYHKDBN'[i >> 4] + '=ACMGRSVTWYHKDBN'[i & 15] for i in range(256)]
+QUAL_TABLE = bytes(bytearray((i + 33) & 0xff for i in range(256)))
+
+# refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq, next_refID, next_pos, tlen
+RECORD = struct.Struct('<iiBBHHHiiii')
+# SAM lines are only split into the fields the stages look at (QNAME, FLAG, RNAME, POS, MAPQ and CIGAR); SEQ, QUAL and
+# the optional fields stay together as the last item of split_line
+SAM_FIELDS = 6
+
+TAG_TYPES = {
+    b'c': ('<b', 1), b'C': ('<B', 1), b's': ('<h', 2), b'S': ('<H', 2),
+    b'i': ('<i', 4), b'I': ('<I', 4), b'f': ('<f', 4)
+}
+
+
+if str is bytes:
+    def _text(b):
+        return b
+else:
+    def _text(b):
+        return b.decode('ascii')
+
+
+class BgzfReader(object):
+    # streaming reader over the concatenated deflate blocks of a BGZF file (BAM)
+
+    def __init__(self, path):
+        self._f = open(path, 'rb')
+        self._block = b''
+        self._offset = 0
+
+    def close(self):
+        self._f.close()
+
+    def _load_block(self):
+        header = self._f.read(12)
+        if len(header) < 12:
+            return False
+        if header[:4] != BGZF_MAGIC:
+            raise ValueError('%s is not a BGZF file' % self._f.name)
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = self._f.read(xlen)
+        bsize = None
+        i = 0
+        while i < xlen:
+            slen = struct.unpack('<H', extra[i + 2:i + 4])[0]
+            if extra[i:i + 2] == b'BC':
+                bsize = struct.unpack('<H', extra[i + 4:i + 6])[0]
+            i += 4 + slen
+        if bsize is None:
+            raise ValueError('%s: BGZF block without BSIZE' % self._f.name)
+        cdata = self._f.read(bsize - xlen - 19)
+        self._f.read(8)
+        self._block = zlib.decompress(cdata, -15)
+        self._offset = 0
+        return True
+
+    def seek_virtual(self, voffset):
+        # virtual offset = compressed offset of the block << 16 | offset within the inflated block
+        self._f.seek(voffset >> 16)
+        self._block = b''
+        self._load_block()
+        self._offset = voffset & 0xffff
+
+    def read(self, size):
+        chunks = []
+        while size > 0:
+            if self._offset >= len(self._block):
+                if not self._load_block():
+                    break
+                continue
+            chunk = self._block[self._offset:self._offset + size]
+            self._offset += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+
+class BamAlignment(object):
+    # decodes QNAME, FLAG, RNAME, POS, MAPQ and CIGAR up front into SAM-like fields; the rest of the record is only
+    # decoded when the alignment is written back out as a SAM line with str()
+    __slots__ = ('fields', '_data', '_refs')
+
+    def __init__(self, data, refs):
+        ref_id, pos, l_read_name, mapq, _, n_cigar_op, flag = RECORD.unpack_from(data)[:7]
+        offset = RECORD.size
+        qname = _text(data[offset:offset + l_read_name - 1])
+        offset += l_read_name
+        cigar = ''.join('%i%s' % (v >> 4, CIGAR_OPS[v & 15])
+                        for v in struct.unpack_from('<%iI' % n_cigar_op, data, offset))
+        self.fields = [qname, str(flag), refs[ref_id] if ref_id >= 0 else '*', str(pos + 1), str(mapq), cigar or '*']
+        self._data = data
+        self._refs = refs
+
+    def __str__(self):
+        data = self._data
+        ref_id, _, l_read_name, _, _, n_cigar_op, _, l_seq, next_ref_id, next_pos, tlen = RECORD.unpack_from(data)
+        if next_ref_id < 0:
+            rnext = '*'
+        elif next_ref_id == ref_id:
+            rnext = '='
+        else:
+            rnext = self._refs[next_ref_id]
+        offset = RECORD.size + l_read_name + 4 * n_cigar_op
+        seq = ''.join(SEQ_PAIRS[b] for b in bytearray(data[offset:offset + (l_seq + 1) // 2]))[:l_seq] or '*'
+        offset += (l_seq + 1) // 2
+        qual = data[offset:offset + l_seq]
+        if not l_seq or qual[:1] == b'\xff':
+            qual = '*'
+        else:
+            qual = _text(qual.translate(QUAL_TABLE))
+        offset += l_seq
+        fields = self.fields + [rnext, str(next_pos + 1), str(tlen), seq, qual] + _decode_tags(data, offset)
+        return '\t'.join(fields) + '\n'
+
+
+def _decode_tags(data, offset):
+    tags = []
+    end = len(data)
+    while offset < end:
+        tag = _text(data[offset:offset + 2])
+        value_type = data[offset + 2:offset + 3]
+        offset += 3
+        if value_type == b'A':
+            tags.append('%s:A:%s' % (tag, _text(data[offset:offset + 1])))
+            offset += 1
+        elif value_type in TAG_TYPES:
+            fmt, size = TAG_TYPES[value_type]
+            value = struct.unpack_from(fmt, data, offset)[0]
+            if value_type == b'f':
+                tags.append('%s:f:%g' % (tag, value))
+            else:
+                tags.append('%s:i:%i' % (tag, value))
+            offset += size
+        elif value_type in (b'Z', b'H'):
+            stop = data.index(b'\x00', offset)
+            tags.append('%s:%s:%s' % (tag, _text(value_type), _text(data[offset:stop])))
+            offset = stop + 1
+        elif value_type == b'B':
+            subtype = data[offset:offset + 1]
+            count = struct.unpack_from('<i', data, offset + 1)[0]
+            fmt, size = TAG_TYPES[subtype]
+            values = struct.unpack_from('<%i%s' % (count, fmt[1]), data, offset + 5)
+            if subtype == b'f':
+                values = ['%g' % v for v in values]
+            else:
+                values = [str(v) for v in values]
+            tags.append('%s:B:%s' % (tag, ','.join([_text(subtype)] + values)))
+            offset += 5 + count * size
+        else:
+            raise ValueError('unknown BAM tag type %r' % value_type)
+    return tags
+
+
+def is_bam(path):
+    with open(path, 'rb') as f:
+        if f.read(4) != BGZF_MAGIC:
+            return False
+    reader = BgzfReader(path)
+    try:
+        return reader.read(4) == BAM_MAGIC
+    finally:
+        reader.close()
+
+
+def read_bam_header(reader):
+    if reader.read(4) != BAM_MAGIC:
+        raise ValueError('not a BAM file')
+    l_text = struct.unpack('<i', reader.read(4))[0]
+    text = _text(reader.read(l_text).rstrip(b'\x00'))
+    refs = []
+    lengths = []
+    n_ref = struct.unpack('<i', reader.read(4))[0]
+    for _ in range(n_ref):
+        l_name = struct.unpack('<i', reader.read(4))[0]
+        refs.append(_text(reader.read(l_name)[:-1]))
+        lengths.append(struct.unpack('<i', reader.read(4))[0])
+    headers = [line + '\n' for line in text.splitlines() if line]
+    if not any(line.startswith('@SQ') for line in headers):
+        headers.extend('@SQ\tSN:%s\tLN:%i\n' % ref for ref in zip(refs, lengths))
+    return headers, refs
+
+
+def iter_bam_records(reader, refs):
+    while True:
+        block_size = reader.read(4)
+        if len(block_size) < 4:
+            return
+        yield BamAlignment(reader.read(struct.unpack('<i', block_size)[0]), refs)
+
+
+def find_bai(path):
+    for index_path in (path + '.bai', os.path.splitext(path)[0] + '.bai'):
+        if os.path.exists(index_path):
+            return index_path
+    return None
+
+
+def read_bai_offsets(path):
+    # virtual offset of the first alignment of each reference (None for references without alignments)
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != BAI_MAGIC:
+        raise ValueError('%s is not a BAM index' % path)
+    n_ref = struct.unpack_from('<i', data, 4)[0]
+    offset = 8
+    offsets = []
+    for _ in range(n_ref):
+        n_bin = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        first = None
+        for _ in range(n_bin):
+            bin_, n_chunk = struct.unpack_from('<Ii', data, offset)
+            offset += 8
+            if bin_ != BAI_PSEUDO_BIN and n_chunk:
+                beg = min(struct.unpack_from('<%iQ' % (2 * n_chunk), data, offset)[::2])
+                if first is None or beg < first:
+                    first = beg
+            offset += 16 * n_chunk
+        n_intv = struct.unpack_from('<i', data, offset)[0]
+        offset += 4 + 8 * n_intv
+        offsets.append(first)
+    return offsets
+
+
+def iter_bam_references(path, names, index_path=None):
+    # like iter_alignment_file() for a coordinate-sorted, indexed BAM, but only reads the alignments on the given
+    # references by seeking straight to them with the .bai
+    offsets = read_bai_offsets(index_path or find_bai(path))
+    reader = BgzfReader(path)
+    try:
+        headers, refs = read_bam_header(reader)
+        for line in headers:
+            yield line, None
+        for ref_id, name in enumerate(refs):
+            if name not in names or offsets[ref_id] is None:
+                continue
+            reader.seek_virtual(offsets[ref_id])
+            for record in iter_bam_records(reader, refs):
+                if record.fields[2] != name:
+                    break
+                yield record, record.fields
+    finally:
+        reader.close()
+
+
+def read_sam_header(path):
+    # header lines of a SAM file and the byte offset of its first alignment
+    headers = []
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.startswith(b'@'):
+                break
+            headers.append(_text(line))
+            offset += len(line)
+    return headers, offset
+
+
+def sam_chunks(path, chunk_size):
+    # (start, end) byte ranges of about chunk_size bytes covering the alignments of a SAM file, cut on line boundaries
+    _, start = read_sam_header(path)
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path, 'rb') as f:
+        while bounds[-1] + chunk_size < size:
+            f.seek(bounds[-1] + chunk_size)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_sam_range(path, start, end):
+    # alignments of a SAM file between two line-aligned byte offsets (see sam_chunks), as (line, split_line)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        offset = start
+        while offset < end:
+            line = f.readline()
+            if not line:
+                break
+            offset += len(line)
+            line = _text(line)
+            yield line, line.split('\t', SAM_FIELDS)
+
+
+def iter_alignment_file(path):
+    # yields (line, split_line) for SAM and BAM input alike. Header lines come with split_line None. For BAM input the
+    # alignment "line" is a BamAlignment; str() of it gives the SAM text line.
+    if is_bam(path):
+        reader = BgzfReader(path)
+        try:
+            headers, refs = read_bam_header(reader)
+            for line in headers:
+                yield line, None
+            for record in iter_bam_records(reader, refs):
+                yield record, record.fields
+        finally:
+            reader.close()
+    else:
+        with open(path) as f:
+            # the header lines all come before the first alignment, so after that no line is checked for '@'
+            for line in f:
+                if not line.startswith('@'):
+                    yield line, line.split('\t', SAM_FIELDS)
+                    break
+                yield line, None
+            for line in f:
+                yield line, line.split('\t', SAM_FIELDS)
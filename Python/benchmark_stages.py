@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+
+parser = argparse.ArgumentParser('Benchmark every python stage of the viral split-read analysis on generated sam files of increasing size. Each stage runs as its own process; wall time, reads/sec and peak RSS are printed and appended as one JSON line per run to a history file, together with the git commit, so that throughput can be compared between versions.')
+
+parser.add_argument(
+    '-n', '--reads', type=int, nargs='+', default=[10000, 100000, 1000000], help='the numbers of reads of the generated sam files (default: 10000 100000 1000000; up to 50000000 is reasonable)')
+parser.add_argument(
+    '-s', '--stages', nargs='+', help='only run these stages (default: all)')
+parser.add_argument(
+    '-w', '--work_dir', default='benchmark_work', help='the directory for the generated inputs and the stage outputs (default: benchmark_work)')
+parser.add_argument(
+    '--history', default='benchmark_history.jsonl', help='the JSON-lines file the results are appended to (default: benchmark_history.jsonl)')
+parser.add_argument(
+    '--repeat', type=int, default=1, help='the number of runs of every stage and size (default: 1)')
+parser.add_argument(
+    '--python', default=sys.executable, help='the python interpreter the stages are run with (default: this one)')
+parser.add_argument(
+    '--seed', type=int, default=1, help='random seed for the generated reads (default: 1)')
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# PR8 segment lengths, with made-up accessions, plus a host chromosome for the off-target reads
+SEGMENTS = [('PR8_seg%i' % (i + 1), length) for i, length in enumerate([2341, 2341, 2233, 1778, 1565, 1413, 1027, 890])]
+HOST = ('chr1', 200000)
+
+# relative frequencies of the generated CIGAR shapes, as (pattern, frequency); M blocks get random lengths
+SHAPES = [('M', 60), ('SM', 6), ('MS', 6), ('MDM', 3), ('MIM', 3), ('MNM', 12), ('SMNM', 2), ('MNMS', 2),
+          ('MDMNM', 1), ('MNMIM', 1), ('MNMNM', 2), ('MNMNMNM', 1), ('MNMNMNMNM', 1)]
+
+TEMPLATES = 4096
+WRITE_BATCH = 10000
+READ_LENGTH = 150
+
+STAGES = [
+    ('filter_IAV_sam', 'filter_IAV_sam.py', '{sam} -g {fasta} -od {out}/'),
+    ('map_qual_filter', 'map_qual_filter_forSTARoutput_IAV_sam.py', '{sam} -od {out}/'),
+    ('split_read_fetch', 'Viral_vRNA_split_reads_alignment_sam_fetch_v5_04092020.py',
+     '--ref_CDS_position {cds} --input_sam_file {sam} --output_sam_file {out}/fetch.sam'),
+    ('boundary_1N', 'DI_boundary_characterization_vRNA_1N_04092020.py', '{sam} -r {ref} -m 25 -sl 0 -o {out}/DI1N.csv'),
+    ('boundary_2N', 'DI_boundary_characterization_allsegments_2N_v6_04092020.py',
+     '{sam} -r {ref} -m 25 -sl 0 -o {out}/DI2N.csv'),
+    ('boundary_3N', 'DI_boundary_characterization_allsegment_3N_v3_04092020.py',
+     '{sam} -r {ref} -m 25 -sl 0 -o {out}/DI3N.csv'),
+    ('boundary_4N', 'DI_boundary_characterization_allsegment_4N_v2_03192020.py',
+     '{sam} -r {ref} -m 25 -sl 0 -o {out}/DI4N.csv'),
+    ('boundary_engine', 'DI_boundary_characterization_engine.py', '{sam} -r {ref} -m 25 -sl 0 -od {out}/'),
+    ('cigar_census', 'extract_cigar_pattern.py', '-indir {sam_dir} -o {out}/cigar_patterns_freq.txt'),
+]
+
+
+def random_cigar(rng, pattern):
+    # M blocks share READ_LENGTH minus clips and insertions; D, I, S and N get their own random lengths
+    lens = []
+    for op in pattern:
+        if op == 'N':
+            lens.append(rng.randint(50, 600))
+        elif op == 'D':
+            lens.append(rng.randint(1, 5))
+        elif op in 'IS':
+            lens.append(rng.randint(1, 10))
+        else:
+            lens.append(0)
+    n_m = pattern.count('M')
+    left = READ_LENGTH - sum(n for op, n in zip(pattern, lens) if op in 'IS')
+    cuts = sorted(rng.randint(1, left - 1) for _ in range(n_m - 1))
+    m_lens = [b - a for a, b in zip([0] + cuts, cuts + [left])]
+    for i, op in enumerate(pattern):
+        if op == 'M':
+            lens[i] = max(m_lens.pop(0), 1)
+    return ''.join('%i%s' % (n, op) for n, op in zip(lens, pattern)), sum(
+        n for op, n in zip(pattern, lens) if op in 'MDN')
+
+
+def make_templates(rng):
+    # every alignment line after the read name; reads are drawn from this pool so that generating a large file is
+    # bound by writing, not by the random number generator
+    shapes = [pattern for pattern, freq in SHAPES for _ in range(freq)]
+    templates = []
+    for _ in range(TEMPLATES):
+        if rng.random() < 0.1:
+            contig, length = HOST
+        else:
+            contig, length = rng.choice(SEGMENTS)
+        cigar, span = random_cigar(rng, rng.choice(shapes))
+        pos = rng.randint(1, max(length - span, 1))
+        seq = ''.join(rng.choice('ACGT') for _ in range(READ_LENGTH))
+        fields = [str(rng.choice([0, 16, 256])), contig, str(pos), rng.choice(['255'] * 9 + ['3']), cigar, '*', '0', '0',
+                  seq, 'I' * READ_LENGTH, 'NH:i:1', 'HI:i:1', 'AS:i:98', 'nM:i:0']
+        templates.append('\t' + '\t'.join(fields) + '\n')
+    return templates
+
+
+def write_inputs(work_dir, n_reads, seed):
+    # sam_<n>/bench.Aligned.out.sam plus the reference files the stages need; files that are already there are kept
+    sam_dir = os.path.join(work_dir, 'sam_%i' % n_reads)
+    sam = os.path.join(sam_dir, 'bench.Aligned.out.sam')
+    files = {
+        'sam': sam,
+        'sam_dir': sam_dir,
+        'fasta': os.path.join(work_dir, 'ref.fasta'),
+        'cds': os.path.join(work_dir, 'ref_CDS_position.txt'),
+        'ref': os.path.join(work_dir, 'ref_seq_id.txt'),
+    }
+    if not os.path.isdir(sam_dir):
+        os.makedirs(sam_dir)
+    with open(files['fasta'], 'w') as f:
+        f.writelines('>%s segment\nACGT\n' % name for name, _ in SEGMENTS)
+    with open(files['cds'], 'w') as f:
+        f.writelines('%s\t%i\t%i\n' % (name, 20, length - 20) for name, length in SEGMENTS + [HOST])
+    with open(files['ref'], 'w') as f:
+        f.writelines('%s\n' % name for name, _ in SEGMENTS)
+    if os.path.exists(sam):
+        return files
+    rng = random.Random(seed)
+    templates = make_templates(rng)
+    with open(sam + '.tmp', 'w', 1 << 20) as f:
+        f.write('@HD\tVN:1.4\tSO:unsorted\n')
+        f.writelines('@SQ\tSN:%s\tLN:%i\n' % contig for contig in SEGMENTS + [HOST])
+        f.write('@PG\tID:benchmark_stages\n')
+        for start in range(0, n_reads, WRITE_BATCH):
+            stop = min(start + WRITE_BATCH, n_reads)
+            f.writelines('read%i%s' % (i, templates[rng.randrange(TEMPLATES)]) for i in range(start, stop))
+    os.rename(sam + '.tmp', sam)
+    return files
+
+
+def git_version():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=SCRIPT_DIR,
+                                           stderr=devnull).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_stage(python, script, arguments, out_dir):
+    # wall time and peak RSS (kB, from the rusage of the finished child) of one run of a stage
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        proc = subprocess.Popen([python, os.path.join(SCRIPT_DIR, script)] + arguments.split(), stdout=devnull)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.time() - start
+    if status:
+        raise RuntimeError('%s failed (wait status %i)' % (script, status))
+    return wall, rusage.ru_maxrss
+
+
+def previous_runs(path):
+    # the last recorded run of every (stage, reads)
+    runs = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    run = json.loads(line)
+                    runs[(run['stage'], run['reads'])] = run
+    return runs
+
+
+def main():
+    args = parser.parse_args()
+    stages = [stage for stage in STAGES if not args.stages or stage[0] in args.stages]
+    previous = previous_runs(args.history)
+    version = git_version()
+    print('%-18s %10s %10s %12s %12s %10s' % ('stage', 'reads', 'wall_s', 'reads/s', 'peak_rss_MB', 'vs_last'))
+    for n_reads in args.reads:
+        files = write_inputs(args.work_dir, n_reads, args.seed)
+        input_bytes = os.path.getsize(files['sam'])
+        for name, script, arguments in stages:
+            out_dir = os.path.join(args.work_dir, 'out_%i' % n_reads, name)
+            files['out'] = out_dir
+            for _ in range(args.repeat):
+                wall, peak_rss = run_stage(args.python, script, arguments.format(**files), out_dir)
+                run = {
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'version': version,
+                    'python': args.python,
+                    'stage': name,
+                    'reads': n_reads,
+                    'input_bytes': input_bytes,
+                    'wall_s': round(wall, 3),
+                    'reads_per_s': round(n_reads / wall, 1),
+                    'peak_rss_kb': peak_rss,
+                }
+                last = previous.get((name, n_reads))
+                change = ''
+                if last:
+                    change = '%+.1f%%' % (100.0 * (run['reads_per_s'] / last['reads_per_s'] - 1))
+                print('%-18s %10i %10.2f %12.0f %12.1f %10s' % (
+                    name, n_reads, wall, run['reads_per_s'], peak_rss / 1024.0, change))
+                with open(args.history, 'a') as f:
+                    f.write(json.dumps(run, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import numpy as np
+
+# Batched CIGAR decoding: a block of CIGAR strings becomes one flat array of operator codes (uint8, index into
+# CIGAR_OPS) and one of operator lengths (int32), plus int64 offsets one longer than the number of reads, so that the
+# operators of read k are codes[offsets[k]:offsets[k + 1]]. Checks that walk the CIGAR of every read are done on these
+# arrays with masks and cumulative sums over the whole block at once.
+
+CIGAR_OPS = 'MIDNSHP=X'
+M, I, D, N, S = range(5)
+UNKNOWN = 255
+
+OP_CODES = np.full(256, UNKNOWN, np.uint8)
+for code, op in enumerate(CIGAR_OPS):
+    OP_CODES[ord(op)] = code
+
+# CIGAR operators that consume the reference, by code
+REF_CONSUMING = np.zeros(256, bool)
+REF_CONSUMING[[CIGAR_OPS.index(op) for op in 'MDN=X']] = True
+
+# operators whose reference bases count as covered, as in bedtools genomecov -split (N gaps are not)
+COVERING = np.zeros(256, bool)
+COVERING[[CIGAR_OPS.index(op) for op in 'MD=X']] = True
+
+# why walk_gaps() drops a read, by code (see stage_metrics.py); 0 is a read that is kept
+REASONS = (None, 'pattern_not_handled', 'no_gap', 'below_min_length', 'below_skip_length')
+
+ZERO = ord('0')
+NINE = ord('9')
+STAR = ord('*')
+
+
+def decode_cigars(cigars):
+    # codes, lengths and offsets of a list of CIGAR strings; '*' gives a read without operators
+    text = ''.join(cigars)
+    if not isinstance(text, bytes):
+        text = text.encode('ascii')
+    chars = np.frombuffer(text, np.uint8)
+    digit = (chars >= ZERO) & (chars <= NINE)
+    is_op = ~digit & (chars != STAR)
+    op_pos = np.flatnonzero(is_op)
+    codes = OP_CODES[chars[op_pos]]
+
+    char_read = np.repeat(np.arange(len(cigars)), [len(cigar) for cigar in cigars])
+    offsets = np.zeros(len(cigars) + 1, np.int64)
+    np.cumsum(np.bincount(char_read[op_pos], minlength=len(cigars)), out=offsets[1:])
+
+    # every digit belongs to the next operator, with a place value given by its distance to it
+    digit_pos = np.flatnonzero(digit)
+    op_index = (np.cumsum(is_op) - is_op)[digit_pos]
+    digit_pos, op_index = digit_pos[op_index < len(op_pos)], op_index[op_index < len(op_pos)]
+    values = (chars[digit_pos] - ZERO) * 10.0 ** (op_pos[op_index] - digit_pos - 1)
+    lens = np.bincount(op_index, weights=values, minlength=len(op_pos)).round().astype(np.int32)
+    return codes, lens, offsets
+
+
+def read_index(offsets):
+    # the read of every operator
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def reference_spans(codes, lens, offsets):
+    return np.bincount(read_index(offsets), weights=lens * REF_CONSUMING[codes],
+                       minlength=len(offsets) - 1).astype(np.int64)
+
+
+def operator_positions(codes, lens, offsets, positions, read=None):
+    # the 1-based reference position of the first base of every operator, from the POS of every read
+    if read is None:
+        read = read_index(offsets)
+    consumed = np.zeros(len(codes) + 1, np.int64)
+    np.cumsum(lens * REF_CONSUMING[codes], out=consumed[1:])
+    return positions[read] + consumed[:-1] - consumed[offsets[:-1]][read]
+
+
+def walk_gaps(codes, lens, offsets, positions, min_length, skip_length):
+    # walk_cigar() and rejection() of the boundary engine for a block of reads. Returns per read the reason code (see
+    # REASONS), the number of N gaps and whether there is any D or I, and the junction coordinates of all the gaps
+    # (the last base before and the first base after each one) as one flat array, two per gap, in read order.
+    n_reads = len(offsets) - 1
+    read = read_index(offsets)
+    count = np.diff(offsets)
+    k = np.arange(len(codes)) - offsets[:-1][read]
+    first = k == 0
+    last = k == count[read] - 1
+    # soft-clipping is only taken at either end; the operators in between are the inner ones
+    lead = first & (codes == S)
+    trail = last & (codes == S) & ~first
+    inner = ~(lead | trail)
+
+    prev = np.empty_like(codes)
+    prev[:1] = UNKNOWN
+    prev[1:] = codes[:-1]
+    has_prev = ~first
+    has_prev[1:] &= ~lead[:-1]
+    after_m = has_prev & (prev == M)
+    # D, I and N only between two Ms (the second M is checked by the next operator or by the last-operator check)
+    allowed = (codes == M) | (((codes == D) | (codes == I) | (codes == N)) & after_m)
+    invalid = np.bincount(read[inner & ~allowed], minlength=n_reads) > 0
+    first_inner = offsets[:-1] + np.bincount(read[lead], minlength=n_reads)
+    last_inner = offsets[1:] - 1 - np.bincount(read[trail], minlength=n_reads)
+    invalid |= last_inner < first_inner
+    invalid[~invalid] |= codes[last_inner[~invalid]] != M
+
+    gap = inner & (codes == N)
+    n_gaps = np.bincount(read[gap], minlength=n_reads)
+    indel = np.bincount(read[inner & ((codes == D) | (codes == I))], minlength=n_reads) > 0
+
+    ref = operator_positions(codes, lens, offsets, positions, read)
+
+    # M blocks are numbered across the block of reads: read r starts its blocks after the r blocks and all the gaps of
+    # the reads before it
+    block = np.cumsum(gap) - gap + read
+    is_m = inner & (codes == M)
+    m_len = np.bincount(block[is_m], weights=lens[is_m], minlength=int(n_gaps.sum()) + n_reads)
+    block_read = np.repeat(np.arange(n_reads), n_gaps + 1)
+    short_block = np.bincount(block_read[m_len < min_length], minlength=n_reads) > 0
+    short_skip = np.bincount(read[gap & (lens < skip_length)], minlength=n_reads) > 0
+
+    # in the order rejection() checks them, so the first failing check is the one reported
+    reasons = np.zeros(n_reads, np.uint8)
+    reasons[short_skip] = 4
+    reasons[short_block] = 3
+    reasons[n_gaps == 0] = 2
+    reasons[invalid] = 1
+
+    coordinates = np.empty(2 * int(n_gaps.sum()), np.int64)
+    coordinates[0::2] = ref[gap] - 1
+    coordinates[1::2] = ref[gap] + lens[gap]
+    return reasons, n_gaps, indel, coordinates
@@ -0,0 +1,87 @@
+import argparse
+import collections
+from junction_matrix import read_junction_matrix, write_matrix, WRITE_BUFFER
+
+parser = argparse.ArgumentParser('Merge the junctions of a junction count matrix (DI_boundary_characterization_engine.py -f mtx) that are the same DI species shifted by a few bases by ambiguous alignment. Per segment, the junction with the most reads becomes the representative of a cluster and takes in every junction not yet clustered whose coordinates are all within the window of its own; then the next best supported junction left does the same. Writes the samples x clusters count matrix in the same layout as the input, with the support of every cluster, and the cluster of every input junction.')
+
+parser.add_argument(
+    'matrix', help='the input matrix without extension (e.g., DI1N_junctions for DI1N_junctions.mtx, DI1N_junctions.samples.txt and DI1N_junctions.junctions.txt)')
+parser.add_argument(
+    '-k', '--window', type=int, default=5, help='the largest difference in bases between any coordinate of a junction and that of the representative of its cluster (default: 5)')
+parser.add_argument(
+    '-o', '--output', required=True, help='the output matrix without extension; <output>.junctions.txt has the representative coordinates followed by the support (reads) and the number of merged junctions of each cluster, and <output>.members.txt the cluster (column of the output matrix, 1-based) of every input junction, line by line')
+
+
+def within(junction, other, window):
+    return all(abs(a - b) <= window for a, b in zip(junction[1:], other[1:]))
+
+
+def cluster_junctions(junctions, support, window):
+    # the cluster of every junction and the representative junction of every cluster. Junctions are put in a grid on
+    # (segment, first coordinate, last coordinate) with cells of window + 1 bases, so everything within the window of a
+    # representative is in the 3 x 3 cells around its own and no junction is compared with more than its neighbours.
+    size = window + 1
+    grid = collections.defaultdict(list)
+    for j, junction in enumerate(junctions):
+        grid[(junction[0], junction[1] // size, junction[-1] // size)].append(j)
+
+    members = [-1] * len(junctions)
+    representatives = []
+    for j in sorted(range(len(junctions)), key=lambda j: (-support[j], junctions[j])):
+        if members[j] >= 0:
+            continue
+        cluster = len(representatives)
+        representatives.append(j)
+        segment, first, last = junctions[j][0], junctions[j][1] // size, junctions[j][-1] // size
+        for cell in [(segment, first + a, last + b) for a in (-1, 0, 1) for b in (-1, 0, 1)]:
+            if cell not in grid:
+                continue
+            left = []
+            for m in grid[cell]:
+                if within(junctions[j], junctions[m], window):
+                    members[m] = cluster
+                else:
+                    left.append(m)
+            # clustered junctions are dropped from the grid so later representatives do not look at them again
+            if left:
+                grid[cell] = left
+            else:
+                del grid[cell]
+    return members, representatives
+
+
+def main():
+    args = parser.parse_args()
+    samples, junctions, entries = read_junction_matrix(args.matrix)
+    support = [0] * len(junctions)
+    for _, col, count in entries:
+        support[col] += count
+
+    members, representatives = cluster_junctions(junctions, support, args.window)
+
+    counts = collections.Counter()
+    for row, col, count in entries:
+        counts[(row, members[col])] += count
+    write_matrix(args.output + '.mtx', len(samples), len(representatives),
+                 [(row, col, counts[(row, col)]) for row, col in sorted(counts)])
+    with open(args.output + '.samples.txt', 'w') as f:
+        f.writelines(sid + '\n' for sid in samples)
+
+    cluster_support = [0] * len(representatives)
+    cluster_size = [0] * len(representatives)
+    for j, cluster in enumerate(members):
+        cluster_support[cluster] += support[j]
+        cluster_size[cluster] += 1
+    n_coordinates = len(junctions[0]) - 1 if junctions else 0
+    with open(args.output + '.junctions.txt', 'w', WRITE_BUFFER) as f:
+        f.write('\t'.join(['segment'] + ['boundary%i' % i for i in range(n_coordinates)] + ['support', 'junctions'])
+                + '\n')
+        for cluster, j in enumerate(representatives):
+            f.write('\t'.join([str(value) for value in junctions[j]] +
+                              [str(cluster_support[cluster]), str(cluster_size[cluster])]) + '\n')
+    with open(args.output + '.members.txt', 'w', WRITE_BUFFER) as f:
+        f.writelines('%i\n' % (cluster + 1) for cluster in members)
+
+
+if __name__ == '__main__':
+    main()
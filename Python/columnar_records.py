@@ -0,0 +1,151 @@
+import os
+import shutil
+import numpy as np
+
+COPY_BUFFER = 1 << 20
+
+INDEX = np.dtype('int32')
+OFFSET = np.dtype('int64')
+
+# dictionary files of a columnar record directory; the matching integer columns hold line numbers into them
+DICTIONARIES = ('samples', 'segments', 'd_features', 'i_features')
+
+
+def _finish_column(path, dtype):
+    # turn the raw column appended to while streaming into a .npy file
+    size = os.path.getsize(path + '.bin') // dtype.itemsize
+    with open(path + '.npy', 'wb') as out:
+        np.lib.format.write_array_header_1_0(
+            out, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (size,)})
+        with open(path + '.bin', 'rb') as f:
+            shutil.copyfileobj(f, out, COPY_BUFFER)
+    os.remove(path + '.bin')
+
+
+class _Dictionary(object):
+
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+
+    def id(self, value):
+        if value is None:
+            return -1
+        if value not in self._ids:
+            self._ids[value] = len(self.values)
+            self.values.append(value)
+        return self._ids[value]
+
+
+class ColumnarRecords(object):
+    # the records with one number of gaps as a directory of .npy columns:
+    #   sample, segment, d_feature, i_feature   int32 ids into samples.txt, segments.txt, d_features.txt and
+    #                                           i_features.txt (-1 for no indel)
+    #   boundary0 .. boundary<2n-1>             int32 junction coordinates, in the order of the csv columns
+    #   readid, d_len, i_len                    ragged columns: <name>_values with the concatenated values of all rows
+    #                                           and <name>_offsets (int64, one longer than the number of rows) so that
+    #                                           the values of row k are values[offsets[k]:offsets[k + 1]]
+    # Rows are appended to raw column files as they come in and turned into .npy files by close().
+
+    def __init__(self, path, n_gaps):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.dictionaries = dict((name, _Dictionary()) for name in DICTIONARIES)
+        self.columns = [('sample', INDEX), ('segment', INDEX)]
+        self.columns.extend(('boundary%i' % i, INDEX) for i in range(2 * n_gaps))
+        self.columns.extend([('d_feature', INDEX), ('i_feature', INDEX)])
+        self.ragged = [('readid', np.dtype('uint8')), ('d_len', INDEX), ('i_len', INDEX)]
+        self._files = {}
+        self._ends = {}
+        for name, _ in self.columns:
+            self._files[name] = open(os.path.join(path, name + '.bin'), 'wb')
+        for name, _ in self.ragged:
+            self._files[name + '_values'] = open(os.path.join(path, name + '_values.bin'), 'wb')
+            self._files[name + '_offsets'] = open(os.path.join(path, name + '_offsets.bin'), 'wb')
+            np.zeros(1, OFFSET).tofile(self._files[name + '_offsets'])
+            self._ends[name] = 0
+
+    def add_sample(self, sid):
+        # header-only files have no rows but are still listed in samples.txt
+        self.dictionaries['samples'].id(sid)
+
+    def add(self, rows):
+        if not rows:
+            return
+        samples = self.dictionaries['samples']
+        segments = self.dictionaries['segments']
+        columns = [[samples.id(row[0]) for row in rows], [segments.id(row[1]) for row in rows]]
+        columns.extend([row[i] for row in rows] for i in range(3, len(rows[0]) - 4))
+        columns.append([self.dictionaries['d_features'].id(row[-4]) for row in rows])
+        columns.append([self.dictionaries['i_features'].id(row[-2]) for row in rows])
+        for (name, dtype), values in zip(self.columns, columns):
+            np.array(values, dtype).tofile(self._files[name])
+
+        readids = [row[2].encode('ascii') if not isinstance(row[2], bytes) else row[2] for row in rows]
+        self._add_ragged('readid', [np.frombuffer(readid, np.uint8) for readid in readids])
+        self._add_ragged('d_len', [row[-3] or () for row in rows])
+        self._add_ragged('i_len', [row[-1] or () for row in rows])
+
+    def _add_ragged(self, name, values):
+        lengths = np.array([len(v) for v in values], OFFSET)
+        dtype = dict(self.ragged)[name]
+        flat = np.concatenate([np.asarray(v, dtype) for v in values]) if lengths.sum() else np.zeros(0, dtype)
+        flat.tofile(self._files[name + '_values'])
+        (self._ends[name] + np.cumsum(lengths)).tofile(self._files[name + '_offsets'])
+        self._ends[name] += int(lengths.sum())
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        for name, dtype in self.columns:
+            _finish_column(os.path.join(self.path, name), dtype)
+        for name, dtype in self.ragged:
+            _finish_column(os.path.join(self.path, name + '_values'), dtype)
+            _finish_column(os.path.join(self.path, name + '_offsets'), OFFSET)
+        for name, dictionary in self.dictionaries.items():
+            with open(os.path.join(self.path, name + '.txt'), 'w') as f:
+                f.writelines(value + '\n' for value in dictionary.values)
+
+
+class ColumnarWriter(object):
+    # drop-in for RecordWriter writing one columnar directory (see ColumnarRecords) per number of gaps
+
+    def __init__(self, segments, outputs, output_name=None):
+        self.segments = segments
+        self.output_name = output_name
+        self._records = {}
+        self._samples = []
+        for n in sorted(outputs):
+            self._open(n, outputs[n])
+
+    def _open(self, n, path):
+        self._records[n] = ColumnarRecords(path, n)
+        for sid in self._samples:
+            self._records[n].add_sample(sid)
+
+    def add(self, sid, records):
+        self._samples.append(sid)
+        for n in sorted(self._records):
+            self._records[n].add_sample(sid)
+        for n in sorted(records or ()):
+            if n not in self._records:
+                self._open(n, self.output_name % n)
+            self._records[n].add(records[n])
+
+    def close(self):
+        for records in self._records.values():
+            records.close()
+
+
+def load_columnar(path, mmap_mode='r'):
+    # columns of a columnar record directory by name (memory-mapped by default) plus the dictionaries as lists
+    data = {}
+    for fn in sorted(os.listdir(path)):
+        name, ext = os.path.splitext(fn)
+        if ext == '.npy':
+            data[name] = np.load(os.path.join(path, fn), mmap_mode=mmap_mode)
+        elif ext == '.txt' and name in DICTIONARIES:
+            with open(os.path.join(path, fn)) as f:
+                data[name] = [line.rstrip('\n') for line in f]
+    return data
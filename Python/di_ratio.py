@@ -0,0 +1,108 @@
+import numpy as np
+from cigar_arrays import COVERING, decode_cigars, read_index, operator_positions, walk_gaps
+
+# Per-segment counters of one sample, kept while the alignments stream by, for the DI ratio table:
+#   split_reads        reads the boundary engine takes as DI junction reads (any number of gaps)
+#   full_length_reads  reads with a CIGAR the engine handles but without any N gap
+#   depth_5prime       reads with an M, D, = or X base on the TERMINUS-th base of the segment
+#   depth_3prime       the same on the TERMINUS-th base from the 3' end (needs the segment length from the @SQ header)
+# di_ratio is split_reads / (split_reads + full_length_reads).
+FIELDS = ('split_reads', 'full_length_reads', 'depth_5prime', 'depth_3prime')
+SPLIT, FULL_LENGTH, DEPTH_5, DEPTH_3 = range(4)
+
+TERMINUS = 30
+
+BATCH_SIZE = 4096
+
+
+class SegmentCounts(object):
+    # counters in a segments x FIELDS array, with segments numbered in sorted order
+
+    def __init__(self, segments, min_length, skip_length):
+        self.names = sorted(segments)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.min_length = min_length
+        self.skip_length = skip_length
+        self.lengths = np.zeros(len(self.names), np.int64)
+        self.counts = np.zeros((len(self.names), len(FIELDS)), np.int64)
+        self._rows = []
+        self._positions = []
+        self._cigars = []
+
+    def header(self, line):
+        if line.startswith('@SQ'):
+            fields = dict(field.split(':', 1) for field in line.rstrip('\r\n').split('\t')[1:] if ':' in field)
+            if fields.get('SN') in self.index and 'LN' in fields:
+                self.lengths[self.index[fields['SN']]] = int(fields['LN'])
+
+    def add(self, split_line):
+        if split_line[2] not in self.index or split_line[5] == '*':
+            return
+        self._rows.append(self.index[split_line[2]])
+        self._positions.append(int(split_line[3]))
+        self._cigars.append(split_line[5])
+        if len(self._cigars) == BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._cigars:
+            return
+        codes, lens, offsets = decode_cigars(self._cigars)
+        rows = np.array(self._rows, np.int64)
+        positions = np.array(self._positions, np.int64)
+        reasons, n_gaps, _, _ = walk_gaps(codes, lens, offsets, positions, self.min_length, self.skip_length)
+        n_segments = len(self.names)
+        self.counts[:, SPLIT] += np.bincount(rows[reasons == 0], minlength=n_segments)
+        self.counts[:, FULL_LENGTH] += np.bincount(rows[reasons == 2], minlength=n_segments)
+
+        read = read_index(offsets)
+        start = operator_positions(codes, lens, offsets, positions, read)
+        covering = COVERING[codes]
+        for field, targets in ((DEPTH_5, np.full(n_segments, TERMINUS, np.int64)),
+                               (DEPTH_3, self.lengths - TERMINUS + 1)):
+            target = targets[rows][read]
+            hit = covering & (start <= target) & (target < start + lens)
+            # a read counts once even if two of its operators meet the base
+            covered = np.bincount(read[hit], minlength=len(rows)) > 0
+            self.counts[:, field] += np.bincount(rows[covered], minlength=n_segments)
+        self._rows, self._positions, self._cigars = [], [], []
+
+    def merge(self, other):
+        # adds the counters of another part (e.g. a chunk) of the same sample
+        self.flush()
+        other.flush()
+        self.counts += other.counts
+        self.lengths = np.maximum(self.lengths, other.lengths)
+
+
+def count_segments(alignments, segment_counts):
+    # passes the stream on unchanged while adding every alignment (and the @SQ lengths) to a SegmentCounts
+    for line, split_line in alignments:
+        if split_line is None:
+            segment_counts.header(line)
+        else:
+            segment_counts.add(split_line)
+        yield line, split_line
+
+
+class RatioTable(object):
+    # the SegmentCounts of every sample, written as one tab-separated sample x segment table
+
+    def __init__(self):
+        self.rows = []
+
+    def track(self, processed):
+        # takes the SegmentCounts off the (sid, records, metrics, segment_counts) of process_files()
+        for sid, records, metrics, segment_counts in processed:
+            self.rows.append((sid, segment_counts))
+            yield sid, records, metrics
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write('\t'.join(('sample', 'segment') + FIELDS + ('di_ratio',)) + '\n')
+            for sid, segment_counts in self.rows:
+                segment_counts.flush()
+                for name, counts in zip(segment_counts.names, segment_counts.counts.tolist()):
+                    total = counts[SPLIT] + counts[FULL_LENGTH]
+                    ratio = '%.6g' % (float(counts[SPLIT]) / total) if total else ''
+                    f.write('\t'.join([sid, name] + [str(count) for count in counts] + [ratio]) + '\n')
@@ -1,30 +1,93 @@
 import argparse
+import collections
+import multiprocessing
 import os
 import re
+from alignment_io import iter_alignment_file
+from pipeline_stages import REF_CONSUMING
 
 parser = argparse.ArgumentParser('Extract the patterns in cigar string for each IAV sam file in a directory.')
 
 parser.add_argument(
-    '-indir', '--input_dir', required=True, help='input directory containing the IAV sam file for each cell')
+    '-indir', '--input_dir', required=True, help='input directory containing the IAV sam or bam file for each cell')
 parser.add_argument(
     '-o', '--output', required=True, help='the file name for the output')
+parser.add_argument(
+    '--census', help='also write the counts per sample, segment and pattern (<census>.by_sample.txt) and, per pattern, the histograms of the reference span (<census>.ref_span.txt) and of the length of every N gap (<census>.gap_length.txt)')
+parser.add_argument(
+    '-j', '--jobs', type=int, default=1, help='the number of files processed in parallel (default: 1)')
+
+
+DIGIT = re.compile(r'\d+')
+CIGAR = re.compile(r'(\d+)([MIDNSHP=X])')
+
+
+def census_file(path):
+    # counts of (sample, segment, pattern), (pattern, reference span) and (pattern, gap length) in one file
+    sample = os.path.basename(path).split('.')[0]
+    by_sample = collections.Counter()
+    ref_span = collections.Counter()
+    gap_length = collections.Counter()
+    for _, split_line in iter_alignment_file(path):
+        if split_line is not None:
+            cigar = split_line[5]
+            pattern = DIGIT.sub('^', cigar)
+            by_sample[(sample, split_line[2], pattern)] += 1
+            if cigar == '*':
+                continue
+            span = 0
+            for n, op in CIGAR.findall(cigar):
+                if op in REF_CONSUMING:
+                    span += int(n)
+                if op == 'N':
+                    gap_length[(pattern, int(n))] += 1
+            ref_span[(pattern, span)] += 1
+    return by_sample, ref_span, gap_length
+
+
+def write_counts(path, header, counts):
+    with open(path, 'w') as f:
+        f.write('\t'.join(header) + '\n')
+        for key in sorted(counts):
+            f.write('\t'.join([str(k) for k in key] + [str(counts[key])]) + '\n')
+
 
-args = parser.parse_args()
+def main():
+    args = parser.parse_args()
+    files = [os.path.join(args.input_dir, fn) for fn in sorted(os.listdir(args.input_dir))
+             if fn.endswith(('.sam', '.bam'))]
 
+    # every file is counted on its own and the counters are added up afterwards
+    totals = (collections.Counter(), collections.Counter(), collections.Counter())
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        try:
+            for counts in pool.imap_unordered(census_file, files):
+                for total, count in zip(totals, counts):
+                    total.update(count)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        for file_ in files:
+            for total, count in zip(totals, census_file(file_)):
+                total.update(count)
+    by_sample, ref_span, gap_length = totals
 
-DIGIT = re.compile('\d+')
+    patterns = collections.Counter()
+    for (_, _, pattern), count in by_sample.items():
+        patterns[pattern] += count
+    with open(args.output, 'a') as f:
+        f.write('\n'.join(['%s\t%i' % (k, v) for k, v in patterns.items()]))
 
-patterns = {}
+    if args.census:
+        write_counts(args.census + '.by_sample.txt', ('sample', 'segment', 'pattern', 'count'), by_sample)
+        write_counts(args.census + '.ref_span.txt', ('pattern', 'ref_span', 'count'), ref_span)
+        write_counts(args.census + '.gap_length.txt', ('pattern', 'gap_length', 'count'), gap_length)
 
-for fn in os.listdir(args.input_dir):
-    with open(fn) as f:
-        for line in f:
-            if not line.startswith('@'):
-                pattern = DIGIT.sub('^', line.split()[5])
-                if pattern in patterns:
-                    patterns[pattern] += 1
-                else:
-                    patterns[pattern] = 1
 
-with open(args.output, 'a') as f:
-    f.write('\n'.join(['%s\t%i' % (k, v) for k, v in patterns.iteritems()]))
+if __name__ == '__main__':
+    main()
@@ -1,55 +1,50 @@
 import os
+import time
 import argparse
+import collections
+from alignment_io import iter_alignment_file, iter_bam_references, is_bam, find_bai
+from pipeline_stages import read_fasta_ids, filter_contigs, write_alignments
+from stage_metrics import StageMetrics, count_alignments
 
 
 # argument parser
 parser = argparse.ArgumentParser('Extract reads mapped to IAV reference genomes.')
 
 parser.add_argument(
-    'files', nargs='+', help='input sam file for each cell')
+    'files', nargs='+', help='input sam or bam file for each cell')
 parser.add_argument(
     '-g', '--reference_genome', required=True, help='IAV reference genomes in fasta format')
 parser.add_argument(
     '-od', '--output_dir', required=True, help='the directory for all the output files')
+parser.add_argument(
+    '--use_index', action='store_true', help='for coordinate-sorted bam files with a .bai index, seek straight to the IAV reference sequences instead of scanning every alignment')
+
 
-args = parser.parse_args()
-
-
-def read_fasta_ids(path):
-    ids = set()
-    with open(path) as f:
-        for l in f:
-            if l.startswith('>'):
-                seqid = l.split(' ')[0][1:]
-                ids.add(seqid)
-    return ids
-
-
-def process_file(file_, fasta_ids):
-    headers = []
-    data = []
-    with open(file_) as f:
-        cid = os.path.basename(file_).split('-')[0]
-        for l in f:
-            if l.startswith('@HD'):
-                headers.append(l)
-            elif l.startswith('@SQ'):
-                if l.split('\t')[1][3:] in fasta_ids:
-                    headers.append(l)
-            elif l.startswith('@PG'):
-                headers.append(l)
-            elif not l.startswith('@'):
-                if l.split('\t')[2] in fasta_ids:
-                    data.append(l)
-    return headers, data, cid
+def process_file(file_, fasta_ids, output_dir, use_index=False):
+    cid = os.path.basename(file_).split('-')[0]
+    if use_index and is_bam(file_) and find_bai(file_):
+        alignments = iter_bam_references(file_, fasta_ids)
+    else:
+        if use_index:
+            print('No .bai index found, scanning the whole file: ' + file_)
+        alignments = iter_alignment_file(file_)
+    output = os.path.join(output_dir, '%s.sam' % cid)
+    counts = collections.Counter()
+    alignments = filter_contigs(count_alignments(alignments, counts, 'scanned'), fasta_ids, counts)
+    # the header lines come first in the input, so the kept lines are written straight through
+    write_alignments(count_alignments(alignments, counts, 'kept'), output)
+    return output, counts
 
 
 def main():
+    args = parser.parse_args()
     ids = read_fasta_ids(args.reference_genome)
     for file_ in args.files:
-        headers, data, cid = process_file(file_, ids)
-        with open(os.path.join(args.output_dir, '%s.sam' % cid), 'w') as f:
-            f.writelines(headers + data)
+        start = time.time()
+        metrics = StageMetrics('filter_IAV_sam')
+        output, counts = process_file(file_, ids, args.output_dir, args.use_index)
+        metrics.add_file(file_, counts, time.time() - start)
+        metrics.write(output + '.metrics.json')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,37 @@
+from alignment_io import iter_alignment_file, iter_bam_references, is_bam, find_bai
+from pipeline_stages import (read_fasta_ids, read_fasta_lengths, read_cds, read_patterns, filter_contigs, filter_mapq,
+                             fetch_split_reads, write_sam, write_alignments)
+from stage_metrics import count_alignments
+from DI_boundary_characterization_engine import read_segments, extract_junctions
+
+# The viral read processing as a library, for running it in-process (from another script or a notebook) instead of
+# calling the scripts one after the other with a sam file in between. Every stage is a generator over the
+# (line, split_line) stream of iter_alignments() and takes an optional Counter for its counts (see stage_metrics.py);
+# the scripts are command-line wrappers around the same functions. With this directory on sys.path:
+#
+#   import collections
+#   import fludi
+#   counts = collections.Counter()
+#   ids = fludi.read_fasta_ids('Influenza_A_H1N1_PR8_refseq.fasta')
+#   alignments = fludi.iter_alignments('s1.Aligned.out.sorted.bam', references=ids)
+#   alignments = fludi.filter_mapq(fludi.filter_contigs(alignments, ids, counts), counts=counts)
+#   alignments = fludi.fetch_split_reads(alignments, fludi.read_cds('PR8_ref_gene_info.txt'), counts=counts)
+#   for n, boundary in fludi.extract_junctions(alignments, fludi.read_segments('PR8_ref_seq_id.txt'), 25, 0,
+#                                              n_gaps={1, 2}):
+#       ...
+#
+# boundary is (segment, read id, the junction coordinates, D feature, D lengths, I feature, I lengths), as in the
+# records of DI_boundary_characterization_engine.py.
+
+__all__ = ['iter_alignments', 'filter_contigs', 'filter_mapq', 'fetch_split_reads', 'extract_junctions',
+           'count_alignments', 'write_sam', 'write_alignments', 'read_fasta_ids', 'read_fasta_lengths', 'read_cds',
+           'read_patterns', 'read_segments']
+
+
+def iter_alignments(path, references=None):
+    # the (line, split_line) stream of a sam or bam file. With references, a coordinate-sorted bam with a .bai index is
+    # only read where the alignments on those reference sequences are; other files are read whole, so filter_contigs()
+    # is still needed to drop the other alignments.
+    if references is not None and is_bam(path) and find_bai(path):
+        return iter_bam_references(path, references)
+    return iter_alignment_file(path)
@@ -0,0 +1,143 @@
+# The junctions of the gapped reads with one number of gaps counted per sample, as a sparse samples x junctions
+# matrix in MatrixMarket coordinate format (<path>.mtx, 1-based, rows are samples and columns junctions) with its row
+# and column index files:
+#   <path>.samples.txt    one sample per line, in input order; samples without any such read are all-zero rows
+#   <path>.junctions.txt  tab-separated segment and boundary0 .. boundary<2n-1>, with a header line
+# In R: counts <- Matrix::readMM('DI1N_junctions.mtx')
+
+MATRIX_HEADER = '%%MatrixMarket matrix coordinate integer general\n'
+
+WRITE_BUFFER = 1 << 20
+
+
+class JunctionTally(object):
+    # the read counts of the junctions of one file (or chunk), counted while the reads are scanned so that a worker
+    # hands on one count per junction instead of one record per read. A junction is (segment id, boundary0, ...) with
+    # the segments numbered in sorted order, and is interned to an integer id per number of gaps as it is first seen;
+    # junctions[n] and counts[n] are indexed by that id.
+
+    def __init__(self, segments):
+        self.segments = sorted(segments)
+        self.junctions = {}
+        self.counts = {}
+        self._segment_ids = dict((segment, i) for i, segment in enumerate(self.segments))
+        self._ids = {}
+
+    def add(self, n, boundary, count=1):
+        # boundary is a record of extract_junctions() with n gaps (segment, readid, boundary0, ...)
+        self._add(n, (self._segment_ids[boundary[0]],) + tuple(int(value) for value in boundary[2:2 + 2 * n]), count)
+
+    def _add(self, n, junction, count):
+        ids = self._ids.setdefault(n, {})
+        junction_id = ids.get(junction)
+        if junction_id is None:
+            junction_id = ids[junction] = len(ids)
+            self.junctions.setdefault(n, []).append(junction)
+            self.counts.setdefault(n, []).append(0)
+        self.counts[n][junction_id] += count
+
+    def merge(self, other):
+        # adds the counts of a later chunk of the same file
+        for n in sorted(other.junctions):
+            for junction, count in zip(other.junctions[n], other.counts[n]):
+                self._add(n, junction, count)
+
+    def __getstate__(self):
+        # the id lookups are rebuilt after unpickling rather than sent between processes
+        return self.segments, self.junctions, self.counts
+
+    def __setstate__(self, state):
+        self.segments, self.junctions, self.counts = state
+        self._segment_ids = dict((segment, i) for i, segment in enumerate(self.segments))
+        self._ids = dict((n, dict((junction, i) for i, junction in enumerate(junctions)))
+                         for n, junctions in self.junctions.items())
+
+
+class JunctionCounts(object):
+    # junctions are interned to column ids as they are first seen, and every sample keeps its (column id, count)s
+
+    def __init__(self, path, n_gaps):
+        self.path = path
+        self.n_gaps = n_gaps
+        self.junctions = []
+        self._ids = {}
+        self._rows = []
+
+    def junction_id(self, junction):
+        if junction not in self._ids:
+            self._ids[junction] = len(self.junctions)
+            self.junctions.append(junction)
+        return self._ids[junction]
+
+    def add(self, row, junctions, counts):
+        # row is the sample's line number in the samples index; junctions and counts those of a JunctionTally
+        self._rows.append((row, sorted((self.junction_id(junction), count)
+                                       for junction, count in zip(junctions, counts))))
+
+    def write(self, samples, segments):
+        # segments are the names of the segment ids of the junctions
+        entries = [(row, col, count) for row, counts in self._rows for col, count in counts]
+        write_matrix(self.path + '.mtx', len(samples), len(self.junctions), entries)
+        with open(self.path + '.samples.txt', 'w') as f:
+            f.writelines(sid + '\n' for sid in samples)
+        with open(self.path + '.junctions.txt', 'w', WRITE_BUFFER) as f:
+            f.write('\t'.join(['segment'] + ['boundary%i' % i for i in range(2 * self.n_gaps)]) + '\n')
+            f.writelines('\t'.join([segments[junction[0]]] + [str(value) for value in junction[1:]]) + '\n'
+                         for junction in self.junctions)
+
+
+def read_junction_matrix(path):
+    # samples, junctions as (segment, boundary0, ...) tuples and the (row, column, count) entries, 0-based
+    with open(path + '.samples.txt') as f:
+        samples = [line.rstrip('\n') for line in f]
+    junctions = []
+    with open(path + '.junctions.txt') as f:
+        # columns after the boundaries (e.g. the support of cluster_junctions.py) are left out
+        n_coordinates = sum(1 for name in next(f).split('\t') if name.startswith('boundary'))
+        for line in f:
+            split_line = line.rstrip('\n').split('\t')
+            junctions.append((split_line[0],) + tuple(int(value) for value in split_line[1:n_coordinates + 1]))
+    entries = []
+    with open(path + '.mtx') as f:
+        for line in f:
+            if not line.startswith('%'):
+                break
+        for line in f:
+            row, col, count = line.split()
+            entries.append((int(row) - 1, int(col) - 1, int(count)))
+    return samples, junctions, entries
+
+
+def write_matrix(path, n_rows, n_cols, entries):
+    # entries are 0-based (row, column, count), written in the order given
+    with open(path, 'w', WRITE_BUFFER) as f:
+        f.write(MATRIX_HEADER)
+        f.write('%i %i %i\n' % (n_rows, n_cols, len(entries)))
+        f.writelines('%i %i %i\n' % (row + 1, col + 1, count) for row, col, count in entries)
+
+
+class JunctionMatrixWriter(object):
+    # drop-in for RecordWriter writing one junction count matrix (see JunctionCounts) per number of gaps, taking the
+    # JunctionTally of every file in place of its records (process_files() with matrix); the matrices are written by
+    # close(), as the number of samples and junctions is only known then
+
+    def __init__(self, segments, outputs, output_name=None):
+        self.segments = sorted(segments)
+        self.output_name = output_name
+        self._counts = {}
+        self._samples = []
+        for n in sorted(outputs):
+            self._counts[n] = JunctionCounts(outputs[n], n)
+
+    def add(self, sid, tally):
+        self._samples.append(sid)
+        if tally is None:
+            return
+        for n in sorted(tally.junctions):
+            if n not in self._counts:
+                self._counts[n] = JunctionCounts(self.output_name % n, n)
+            self._counts[n].add(len(self._samples) - 1, tally.junctions[n], tally.counts[n])
+
+    def close(self):
+        for counts in self._counts.values():
+            counts.write(self._samples, self.segments)
@@ -1,37 +1,39 @@
 import os
+import time
 import argparse
+import collections
+from alignment_io import iter_alignment_file
+from pipeline_stages import filter_mapq, write_alignments
+from stage_metrics import StageMetrics, count_alignments
 
 
 # argument parser
 parser = argparse.ArgumentParser('Fill IAV sam files from STAR output to exclude multi-mapper (MAPQ != 255).')
 
 parser.add_argument(
-    'files', nargs='+', help='input sam file for each cell')
+    'files', nargs='+', help='input sam or bam file for each cell')
 parser.add_argument(
     '-od', '--output_dir', required=True, help='the directory for all the output files')
 
-args = parser.parse_args()
 
-
-def process_file(file_):
-    headers = []
-    data = []
-    with open(file_) as f:
-        cid = os.path.basename(file_).split('.')[0]
-        for l in f:
-            if l.startswith('@'):
-                headers.append(l)
-            else:
-                if l.split('\t')[4] == '255':
-                    data.append(l)
-    return headers, data, cid
+def process_file(file_, output_dir):
+    cid = os.path.basename(file_).split('.')[0]
+    output = os.path.join(output_dir, '%s.sam' % cid)
+    counts = collections.Counter()
+    alignments = filter_mapq(count_alignments(iter_alignment_file(file_), counts, 'scanned'), counts=counts)
+    # the header lines come first in the input, so the kept lines are written straight through
+    write_alignments(count_alignments(alignments, counts, 'kept'), output)
+    return output, counts
 
 
 def main():
+    args = parser.parse_args()
     for file_ in args.files:
-        headers, data, cid = process_file(file_)
-        with open(os.path.join(args.output_dir, '%s.sam' % cid), 'w') as f:
-            f.writelines(headers + data)
+        start = time.time()
+        metrics = StageMetrics('map_qual_filter_forSTARoutput_IAV_sam')
+        output, counts = process_file(file_, args.output_dir)
+        metrics.add_file(file_, counts, time.time() - start)
+        metrics.write(output + '.metrics.json')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+import re
+import tempfile
+from alignment_io import SAM_FIELDS
+
+# Generator stages over the (line, split_line) stream of alignment_io.iter_alignment_file(): header lines come with
+# split_line None, split_line[:6] of an alignment are QNAME to CIGAR (the later fields are not split, see SAM_FIELDS),
+# and every stage passes the alignments it keeps on unchanged so stages can be chained.
+
+UPPERCASE = re.compile(r'([A-Z=])')
+
+# CIGAR operators that consume the reference
+REF_CONSUMING = frozenset('MDN=X')
+
+WRITE_BUFFER = 1 << 20
+
+
+def read_fasta_ids(path):
+    ids = set()
+    with open(path) as f:
+        for l in f:
+            if l.startswith('>'):
+                seqid = l.split(' ')[0][1:]
+                ids.add(seqid)
+    return ids
+
+
+def read_fasta_lengths(path):
+    # (seqid, length) of every sequence, in file order
+    lengths = []
+    with open(path) as f:
+        for l in f:
+            if l.startswith('>'):
+                lengths.append([l.split(' ')[0][1:].rstrip('\r\n'), 0])
+            elif lengths:
+                lengths[-1][1] += len(l.strip())
+    return [tuple(length) for length in lengths]
+
+
+def read_cds(path):
+    cds = {}
+    with open(path) as f:
+        for line in f:
+            split_line = line.split('\t')
+            cds[split_line[0]] = {
+                'min': int(split_line[1]),
+                'max': int(split_line[2])
+            }
+    return cds
+
+
+def read_patterns(path):
+    # one CIGAR pattern per line (e.g. MNMDM); the first column of the extract_cigar_pattern.py output is accepted too
+    patterns = set()
+    with open(path) as f:
+        for line in f:
+            pattern = line.split('\t')[0].strip().replace('^', '')
+            if pattern:
+                patterns.add(pattern)
+    return frozenset(patterns)
+
+
+def extract_align_info(split_line):
+    sposition1 = int(split_line[3])
+    cigar = {'cha': [], 'len': []}
+    last = None
+    for i, s in enumerate(re.split(UPPERCASE, split_line[5])):
+        if s:
+            if i % 2 == 0:
+                last = int(s)
+            else:
+                cigar['cha'].append(s)
+                cigar['len'].append(last)
+    return sposition1, cigar
+
+
+def reference_span(cigar):
+    return sum(n for op, n in zip(cigar['cha'], cigar['len']) if op in REF_CONSUMING)
+
+
+def is_in_range(cigar, split_line, cds):
+    segment = split_line[2]
+    info = cds[segment]
+    firstbase = int(split_line[3])
+    lastbase = firstbase + reference_span(cigar) - 1
+    return (info['min'] <= firstbase) and (lastbase <= info['max'])
+
+
+def is_split_read(split_line, cds, patterns=None, counts=None):
+    # any alignment with at least one N (and, given patterns, a CIGAR pattern among them) inside the coding region.
+    # counts, if given, gets the parsed alignments and the reasons for dropping them (see stage_metrics.py).
+    _, cigar = extract_align_info(split_line)
+    reason = None
+    if 'N' not in cigar['cha']:
+        reason = 'no_gap'
+    elif patterns is not None and ''.join(cigar['cha']) not in patterns:
+        reason = 'pattern_not_handled'
+    elif not is_in_range(cigar, split_line, cds):
+        reason = 'outside_cds'
+    if counts is not None:
+        counts['parsed'] += 1
+        if reason:
+            counts[reason] += 1
+    return reason is None
+
+
+def filter_contigs(alignments, fasta_ids, counts=None):
+    # filter_IAV_sam.py: alignments on the given reference sequences, with the @HD, @PG and matching @SQ headers
+    for line, split_line in alignments:
+        if split_line is None:
+            if line.startswith('@HD'):
+                yield line, split_line
+            elif line.startswith('@SQ'):
+                if line.split('\t')[1][3:] in fasta_ids:
+                    yield line, split_line
+            elif line.startswith('@PG'):
+                yield line, split_line
+        elif split_line[2] in fasta_ids:
+            yield line, split_line
+        elif counts is not None:
+            counts['off_target_contig'] += 1
+
+
+def filter_mapq(alignments, mapq='255', counts=None):
+    # map_qual_filter_forSTARoutput_IAV_sam.py: unique STAR alignments (MAPQ 255) and every header line
+    for line, split_line in alignments:
+        if split_line is None or split_line[4] == mapq:
+            yield line, split_line
+        elif counts is not None:
+            counts['mapq_not_255'] += 1
+
+
+def _spilled(f):
+    f.seek(0)
+    for line in f:
+        yield line, line.split('\t', SAM_FIELDS)
+
+
+def fetch_split_reads(alignments, cds, patterns=None, counts=None):
+    # the split-read fetch: header lines, then the split reads in the coding regions grouped by segment in sorted
+    # order, each segment in input order. The reads of the segment whose turn it is are passed straight on; those of
+    # later segments are spilled to temporary files until their turn comes. With coordinate-sorted input (SO:coordinate
+    # in @HD) a segment's turn comes as soon as the alignments have moved past it in @SQ order, so when the @SQ order is
+    # the sorted order nothing is spilled at all. Otherwise all turns come at the end of the input.
+    order = sorted(cds)
+    sq_index = {}
+    coordinate_sorted = False
+    spills = {}
+    turn = 0
+    contig = None
+    rank = -1
+    try:
+        for line, split_line in alignments:
+            if split_line is None:
+                if line.startswith('@HD') and 'SO:coordinate' in line:
+                    coordinate_sorted = True
+                elif line.startswith('@SQ'):
+                    sq_index[line.split('\t')[1][3:]] = len(sq_index)
+                yield line, split_line
+                continue
+            if split_line[2] != contig:
+                contig = split_line[2]
+                if coordinate_sorted:
+                    # unmapped reads ('*') come last
+                    new_rank = sq_index.get(contig, len(sq_index))
+                    if new_rank < rank:
+                        raise ValueError('alignments are not coordinate-sorted: %s comes after a later reference '
+                                         'sequence' % contig)
+                    rank = new_rank
+                    while turn < len(order) and sq_index.get(order[turn], -1) < rank:
+                        if order[turn] in spills:
+                            for alignment in _spilled(spills.pop(order[turn])):
+                                yield alignment
+                        turn += 1
+            if is_split_read(split_line, cds, patterns, counts):
+                if turn < len(order) and contig == order[turn]:
+                    yield line, split_line
+                else:
+                    if contig not in spills:
+                        spills[contig] = tempfile.TemporaryFile('w+')
+                    spills[contig].write(str(line))
+        for seg in sorted(spills):
+            for alignment in _spilled(spills[seg]):
+                yield alignment
+    finally:
+        for f in spills.values():
+            f.close()
+
+
+def write_sam(alignments, path):
+    # passes the stream on unchanged while writing it to a sam file
+    with open(path, 'w', WRITE_BUFFER) as f:
+        for line, split_line in alignments:
+            f.write(str(line))
+            yield line, split_line
+
+
+def write_alignments(alignments, path):
+    # writes the whole stream to a sam file without holding on to any of it
+    with open(path, 'w', WRITE_BUFFER) as f:
+        for line, _ in alignments:
+            f.write(str(line))
@@ -0,0 +1,228 @@
+import os
+import re
+import time
+import heapq
+import argparse
+import collections
+from alignment_io import iter_alignment_file, SAM_FIELDS
+from pipeline_stages import write_alignments
+from stage_metrics import StageMetrics, count_alignments
+
+parser = argparse.ArgumentParser('Remove duplicate reads from coordinate-sorted IAV sam files, like Picard MarkDuplicates REMOVE_DUPLICATES=true ASSUME_SORTED=true. Read pairs are duplicates when both ends have the same unclipped 5\' position and strand, single reads (and reads whose mate is unmapped) when their own end is the same; of each set the one with the highest sum of base qualities of at least 15 is kept, and single reads at the end of a pair are always removed. Unmapped, secondary and supplementary alignments are kept, as are pairs whose mate is on another segment or not in the file.')
+
+parser.add_argument(
+    'files', nargs='+', help='input coordinate-sorted sam or bam file for each cell (e.g., 5_py_alignment_quality_filtering/*.sam)')
+parser.add_argument(
+    '-od', '--output_dir', required=True, help='the directory for all the output files')
+
+CIGAR = re.compile(r'(\d+)([MIDNSHP=X])')
+REF_CONSUMING = frozenset('MDN=X')
+CLIPS = frozenset('SH')
+
+PAIRED = 0x1
+UNMAPPED = 0x4
+MATE_UNMAPPED = 0x8
+REVERSE = 0x10
+NOT_PRIMARY = 0x100 | 0x800
+
+# Picard's SUM_OF_BASE_QUALITIES: only bases of at least this quality count
+MIN_SCORED_QUALITY = 15
+# QUAL characters translated into the score of each base
+SCORE_TABLE = ''.join(chr(max(c - 33, 0)) if c - 33 >= MIN_SCORED_QUALITY else '\0' for c in range(256))
+if str is not bytes:
+    SCORE_TABLE = dict(enumerate(SCORE_TABLE))
+
+# an end is packed into one integer from (reference, unclipped 5' position, strand), a pair into one integer from its
+# two ends; positions are offset so that clips hanging over the start of a segment stay positive
+POSITION_OFFSET = 1 << 31
+END_BITS = 64
+
+
+def unclipped_end(position, cigar, reverse):
+    # the unclipped 5' position of a read: its first base if forward, its last base if reverse
+    ops = CIGAR.findall(cigar)
+    span = sum(int(n) for n, op in ops if op in REF_CONSUMING)
+    clipped = 0
+    for n, op in reversed(ops) if reverse else ops:
+        if op not in CLIPS:
+            break
+        clipped += int(n)
+    if reverse:
+        return position + span - 1 + clipped
+    return position - clipped
+
+
+def mate_fields(line, split_line):
+    # RNEXT, PNEXT, TLEN, SEQ and QUAL (the fields after the CIGAR, which the stream does not split)
+    if len(split_line) > SAM_FIELDS:
+        rest = split_line[SAM_FIELDS]
+    else:
+        rest = str(line).split('\t', SAM_FIELDS)[SAM_FIELDS]
+    fields = rest.split('\t', 5)[:5]
+    fields[-1] = fields[-1].rstrip('\r\n')
+    return fields
+
+
+def quality_score(entry):
+    return sum(bytearray(entry[3].translate(SCORE_TABLE), 'latin-1'))
+
+
+class DuplicateWindow(object):
+    # Duplicate sets of a coordinate-sorted stream. A reverse read comes before its unclipped 5' end and a forward read
+    # comes after it by its clipped bases, which are never more than the read is long, so a set is settled once the
+    # stream has moved past its end by more than `window`, the longest read or clip seen. Reads are held until the sets
+    # they are in are settled and are then handed on in input order. Entries are [line, split_line, keep (None until
+    # settled), QUAL].
+
+    def __init__(self, counts=None):
+        self.counts = counts
+        self.pending = collections.deque()
+        self.fragments = {}
+        self.pairs = {}
+        self.mates = {}
+        self.settling = []
+        self.window = 0
+        self.references = {}
+        self.reference = None
+        self.position = 0
+        self._order = 0
+
+    def _end(self, reference, position, reverse):
+        return (((self.references[reference] << 32) + position + POSITION_OFFSET) << 1) | reverse
+
+    def _schedule(self, position, kind, key):
+        # sets are settled in the order of the position they are waiting for
+        self._order += 1
+        heapq.heappush(self.settling, (position, self._order, kind, key))
+
+    def add(self, line, split_line):
+        entry = [line, split_line, True, None]
+        self.pending.append(entry)
+        flag = int(split_line[1])
+        reference = split_line[2]
+        if flag & (UNMAPPED | NOT_PRIMARY) or reference == '*':
+            return
+        position = int(split_line[3])
+        if reference != self.reference:
+            if reference in self.references:
+                raise ValueError('alignments are not coordinate-sorted: %s comes after a later reference sequence'
+                                 % reference)
+            self.settle()
+            self.references[reference] = len(self.references)
+            self.reference = reference
+        elif position < self.position:
+            raise ValueError('alignments are not coordinate-sorted: %s:%i comes after %s:%i'
+                             % (reference, position, reference, self.position))
+        self.position = position
+
+        reverse = flag & REVERSE
+        five_prime = unclipped_end(position, split_line[5], reverse)
+        end = self._end(reference, five_prime, 1 if reverse else 0)
+        rnext, pnext, _, seq, entry[3] = mate_fields(line, split_line)
+        self.window = max(self.window, position - five_prime, len(seq))
+        self.settle(position)
+        if flag & PAIRED and not flag & MATE_UNMAPPED:
+            # a paired read makes every single read on its end a duplicate
+            if end not in self.fragments:
+                self.fragments[end] = [True, []]
+                self._schedule(five_prime, 'fragment', end)
+            else:
+                self.fragments[end][0] = True
+            if rnext not in ('=', reference):
+                return
+            qname = split_line[0]
+            if qname not in self.mates:
+                entry[2] = None
+                self.mates[qname] = (entry, end, five_prime)
+                # the mate of a read comes at its PNEXT; if it has not come by the time the stream moves past it, the
+                # read is kept on its own
+                self._schedule(int(pnext), 'mate', qname)
+                return
+            mate, mate_end, mate_five_prime = self.mates.pop(qname)
+            key = (min(end, mate_end) << END_BITS) | max(end, mate_end)
+            if key not in self.pairs:
+                self.pairs[key] = []
+                self._schedule(max(five_prime, mate_five_prime), 'pair', key)
+            entry[2] = None
+            self.pairs[key].append((mate, entry))
+        else:
+            if end not in self.fragments:
+                self.fragments[end] = [False, []]
+                self._schedule(five_prime, 'fragment', end)
+            entry[2] = None
+            self.fragments[end][1].append(entry)
+
+    def settle(self, position=None):
+        # settles the sets whose reads have all been seen at this position, or every set at the end of a reference
+        while self.settling and (position is None or self.settling[0][0] + self.window < position):
+            _, _, kind, key = heapq.heappop(self.settling)
+            if kind == 'fragment':
+                paired, entries = self.fragments.pop(key)
+                best = None
+                if entries and not paired:
+                    best = entries[0] if len(entries) == 1 else max(entries, key=quality_score)
+                for entry in entries:
+                    self._decide(entry, entry is best)
+            elif kind == 'pair':
+                pairs = self.pairs.pop(key)
+                best = pairs[0]
+                if len(pairs) > 1:
+                    best = max(pairs, key=lambda pair: quality_score(pair[0]) + quality_score(pair[1]))
+                for pair in pairs:
+                    self._decide(pair[0], pair is best)
+                    self._decide(pair[1], pair is best)
+            elif key in self.mates:
+                # the mate never came
+                self._decide(self.mates.pop(key)[0], True)
+
+    def _decide(self, entry, keep):
+        entry[2] = keep
+        if not keep and self.counts is not None:
+            self.counts['duplicate'] += 1
+
+    def pop(self):
+        # the settled alignments at the front of the stream
+        while self.pending and self.pending[0][2] is not None:
+            entry = self.pending.popleft()
+            if entry[2]:
+                yield entry[0], entry[1]
+
+
+def remove_duplicates(alignments, counts=None):
+    # Picard MarkDuplicates REMOVE_DUPLICATES=true on a coordinate-sorted stream, see DuplicateWindow. counts, if given,
+    # gets the removed alignments as 'duplicate' (see stage_metrics.py).
+    duplicates = DuplicateWindow(counts)
+    for line, split_line in alignments:
+        if split_line is None:
+            yield line, split_line
+            continue
+        duplicates.add(line, split_line)
+        for alignment in duplicates.pop():
+            yield alignment
+    duplicates.settle()
+    for alignment in duplicates.pop():
+        yield alignment
+
+
+def process_file(file_, output_dir):
+    cid = os.path.basename(file_).split('.')[0]
+    output = os.path.join(output_dir, '%s.sam' % cid)
+    counts = collections.Counter()
+    alignments = remove_duplicates(count_alignments(iter_alignment_file(file_), counts, 'scanned'), counts=counts)
+    write_alignments(count_alignments(alignments, counts, 'kept'), output)
+    return output, counts
+
+
+def main():
+    args = parser.parse_args()
+    for file_ in args.files:
+        print('Processing file: ' + file_)
+        start = time.time()
+        metrics = StageMetrics('remove_duplicates_sam')
+        output, counts = process_file(file_, args.output_dir)
+        metrics.add_file(file_, counts, time.time() - start)
+        metrics.write(output + '.metrics.json')
+
+
+if __name__ == '__main__':
+    main()
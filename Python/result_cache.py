@@ -0,0 +1,62 @@
+import os
+import sys
+import pickle
+import hashlib
+
+HASH_BUFFER = 1 << 20
+
+# results are pickled with a protocol both python 2 and 3 read, but the string types differ between the two, so each
+# major version keeps its own entries
+PICKLE_PROTOCOL = 2
+
+
+def file_key(path, content_hash=False):
+    # the name of the file (the sample id is derived from it) plus either its size and modification time or a SHA-1 of
+    # its contents
+    name = os.path.basename(path)
+    if not content_hash:
+        st = os.stat(path)
+        return '%s:%s:%i:%r' % (name, os.path.abspath(path), st.st_size, st.st_mtime)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BUFFER), b''):
+            digest.update(block)
+    return '%s:sha1:%s' % (name, digest.hexdigest())
+
+
+class ResultCache(object):
+    # one pickle per input file and parameter set in a cache directory. params must have a stable repr() (no sets
+    # or dicts), and must change whenever the result of processing a file would.
+
+    def __init__(self, path, params, content_hash=False):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.params = repr((sys.version_info[0],) + tuple(params))
+        self.content_hash = content_hash
+        self._entries = {}
+
+    def _entry(self, file_):
+        # looked up once per file, as hashing the contents of a large file takes a while
+        if file_ not in self._entries:
+            key = self.params + '\n' + file_key(file_, self.content_hash)
+            self._entries[file_] = os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pickle')
+        return self._entries[file_]
+
+    def get(self, file_):
+        # the stored result, or None if there is none (or it cannot be read)
+        entry = self._entry(file_)
+        if not os.path.exists(entry):
+            return None
+        try:
+            with open(entry, 'rb') as f:
+                return pickle.load(f)
+        except (EOFError, IOError, pickle.UnpicklingError):
+            return None
+
+    def put(self, file_, result):
+        # written under a temporary name first, so an interrupted run never leaves a truncated entry behind
+        entry = self._entry(file_)
+        with open(entry + '.%i.tmp' % os.getpid(), 'wb') as f:
+            pickle.dump(result, f, PICKLE_PROTOCOL)
+        os.rename(entry + '.%i.tmp' % os.getpid(), entry)
@@ -0,0 +1,365 @@
+import argparse
+import numpy as np
+
+parser = argparse.ArgumentParser('Simulate STAR-like alignments of full-length and DI (deletion junction) reads on the PR8 segments with known answers. Writes <prefix>.sam, <prefix>.fastq and <prefix>.truth.csv; the boundaries in the truth table are the ones the DI boundary scripts report (the last base before and the first base after every N gap).')
+
+parser.add_argument(
+    '-g', '--reference_genome', required=True, help='IAV reference genomes in fasta format')
+parser.add_argument(
+    '-r', '--ref', required=True, help='a list of ref sequence id text file (e.g., PR8_ref_seq_id.txt); reads are simulated on these segments')
+parser.add_argument(
+    '-n', '--reads', type=int, required=True, help='the number of reads to simulate, duplicates included')
+parser.add_argument(
+    '-o', '--output_prefix', required=True, help='prefix of the output files')
+parser.add_argument(
+    '-l', '--read_length', type=int, default=150, help='read length (default: 150)')
+parser.add_argument(
+    '--di_fraction', type=float, default=0.2, help='fraction of DI reads, i.e. reads spanning at least one junction (default: 0.2)')
+parser.add_argument(
+    '--gap_fractions', type=float, nargs=4, default=[0.9, 0.07, 0.02, 0.01], help='relative frequencies of DI reads with 1, 2, 3 and 4 gaps (default: 0.9 0.07 0.02 0.01)')
+parser.add_argument(
+    '--di_species', type=int, default=50, help='the number of distinct DI species per segment and number of gaps (default: 50)')
+parser.add_argument(
+    '--junction_distribution', choices=('termini', 'uniform'), default='termini', help='where the deletions of the DI species are: termini keeps a few hundred bases at both segment ends like natural DI RNAs, uniform puts them anywhere (default: termini)')
+parser.add_argument(
+    '--abundance_sigma', type=float, default=1.0, help='sigma of the log-normal abundance of the DI species (default: 1.0)')
+parser.add_argument(
+    '--min_anchor', type=int, default=10, help='the minimum number of bases of a read on either side of its junctions (default: 10)')
+parser.add_argument(
+    '--soft_clip_fraction', type=float, default=0.05, help='fraction of reads soft-clipped at each end (default: 0.05)')
+parser.add_argument(
+    '--indel_fraction', type=float, default=0.03, help='fraction of reads with a 1-3 base deletion or insertion (default: 0.03)')
+parser.add_argument(
+    '--multimapper_fraction', type=float, default=0.05, help='fraction of reads written as STAR multi-mappers with MAPQ 3 (default: 0.05)')
+parser.add_argument(
+    '--duplicate_fraction', type=float, default=0.1, help='fraction of reads that are exact duplicates of another read (default: 0.1)')
+parser.add_argument(
+    '--error_rate', type=float, default=0.002, help='per-base substitution rate (default: 0.002)')
+parser.add_argument(
+    '--seed', type=int, default=1, help='random seed (default: 1)')
+parser.add_argument(
+    '--batch_size', type=int, default=100000, help='the number of reads generated at a time (default: 100000)')
+
+BASES = np.frombuffer(b'ACGT', np.uint8)
+COMPLEMENT = np.zeros(256, np.uint8)
+COMPLEMENT[np.frombuffer(b'ACGTN', np.uint8)] = np.frombuffer(b'TGCAN', np.uint8)
+QUALITIES = np.frombuffer(b'FFFFFFF:,', np.uint8)
+NUMBERS = np.arange(1 << 16).astype(np.bytes_)
+
+# longest soft clip at either end and longest deletion or insertion
+MAX_CLIP = 10
+MAX_INDEL = 3
+
+# the layout of every read, as slots of which the empty ones are dropped from the CIGAR: soft clip, the first block
+# (split around an optional deletion or insertion), N gaps with the inner blocks between them, the last block (split
+# the same way) and a soft clip
+BLOCK_SLOTS = ['M', 'D', 'I', 'M']
+
+# columns of <prefix>.truth.csv: boundaries are the 2 * n_gaps junction coordinates separated by ';', species is -1 for
+# full-length reads, and min_block is the shortest M block between gaps (what --min_length is compared against)
+TRUTH_HEADER = ['read_id', 'segment', 'n_gaps', 'species', 'boundaries', 'min_block', 'cigar', 'mapq', 'duplicate_of']
+
+
+def read_fasta(path, ids):
+    seqs = {}
+    name = None
+    with open(path) as f:
+        for line in f:
+            if line.startswith('>'):
+                name = line[1:].split()[0]
+                seqs[name] = []
+            elif name is not None:
+                seqs[name].append(line.strip().upper())
+    return [(seqid, ''.join(seqs[seqid])) for seqid in ids if seqid in seqs]
+
+
+def read_ids(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def random_ints(rng, low, high, size=None):
+    # like rng.randint(low, high) but with array bounds, which RandomState.randint does not take
+    if size is None:
+        size = np.broadcast(low, high).shape
+    return np.asarray(low) + (rng.random_sample(size) * (np.asarray(high) - low)).astype(int)
+
+
+def random_compositions(rng, totals, parts, minimum):
+    # (len(totals), parts) random integers >= minimum summing to totals
+    totals = np.asarray(totals)
+    if parts == 1:
+        return totals[:, None].copy()
+    free = totals - parts * minimum
+    cuts = np.sort(random_ints(rng, 0, free[:, None] + 1, (len(totals), parts - 1)), axis=1)
+    bounds = np.concatenate([np.zeros((len(totals), 1), int), cuts, free[:, None]], axis=1)
+    return np.diff(bounds, axis=1) + minimum
+
+
+def make_species(rng, lengths, n_gaps, n_species, read_length, min_anchor, distribution, sigma):
+    # DI species with n_gaps deletions: (segment index, boundaries of shape (n, 2 * n_gaps), abundance weights).
+    # The inner blocks between two deletions are short enough for a read to span all of them, and the first and last
+    # deletion leave more than a read length at the segment ends.
+    n_segments = len(lengths)
+    segment = np.repeat(np.arange(n_segments), n_species)
+    seglen = lengths[segment]
+    n = len(segment)
+    margin = read_length + 5
+    if n_gaps > 1:
+        inner_max = max((read_length - 2 * min_anchor - 2 * MAX_CLIP - MAX_INDEL) // (n_gaps - 1) - 1, min_anchor)
+        inner = rng.randint(min_anchor, inner_max + 1, (n, n_gaps - 1))
+    else:
+        inner = np.zeros((n, 0), int)
+    room = seglen - 2 * margin - inner.sum(axis=1)
+    if distribution == 'termini':
+        # most of the deleted part sits in the middle of the segment
+        kept5 = (rng.beta(1.5, 6.0, n) * room / 2).astype(int)
+        kept3 = (rng.beta(1.5, 6.0, n) * room / 2).astype(int)
+    else:
+        kept5 = random_ints(rng, 0, np.maximum(room // 2, 1))
+        kept3 = random_ints(rng, 0, np.maximum(room // 2, 1))
+    deleted = np.maximum(room - kept5 - kept3, n_gaps * 20)
+    gaps = random_compositions(rng, deleted, n_gaps, 20)
+
+    boundaries = np.zeros((n, 2 * n_gaps), int)
+    position = margin + kept5
+    for j in range(n_gaps):
+        boundaries[:, 2 * j] = position
+        position = position + gaps[:, j] + 1
+        boundaries[:, 2 * j + 1] = position
+        if j < n_gaps - 1:
+            position = position + inner[:, j] - 1
+    ok = boundaries[:, -1] <= seglen - margin
+    weights = rng.lognormal(0.0, sigma, n) * ok
+    return segment, boundaries, weights / weights.sum()
+
+
+def simulate_layout(rng, n, n_gaps, segment, boundaries, lengths, args):
+    # slot lengths (n, slots), slot operators and the 1-based reference start of every read
+    read_length = args.read_length
+    clip5 = (rng.random_sample(n) < args.soft_clip_fraction) * rng.randint(1, MAX_CLIP + 1, n)
+    clip3 = (rng.random_sample(n) < args.soft_clip_fraction) * rng.randint(1, MAX_CLIP + 1, n)
+    indel = rng.random_sample(n) < args.indel_fraction
+    indel_len = indel * rng.randint(1, MAX_INDEL + 1, n)
+    is_insertion = rng.random_sample(n) < 0.5
+    ins = indel_len * is_insertion
+    dels = indel_len * ~is_insertion
+    # the indel goes into the first or the last block
+    in_last = (rng.random_sample(n) < 0.5) & (n_gaps > 0)
+    query = read_length - clip5 - clip3 - ins
+
+    if n_gaps:
+        inner = boundaries[:, 2:-1:2] - boundaries[:, 1:-2:2] + 1
+        outer = query - inner.sum(axis=1)
+        first = random_ints(rng, args.min_anchor, outer - args.min_anchor + 1)
+        last = outer - first
+    else:
+        inner = np.zeros((n, 0), int)
+        first = query
+        last = np.zeros(n, int)
+
+    def split_block(mlen, has_indel):
+        cut = np.where(has_indel, random_ints(rng, 1, np.maximum(mlen, 2)), mlen)
+        return [cut, dels * has_indel, ins * has_indel, mlen - cut]
+
+    ops = ['S'] + BLOCK_SLOTS
+    slots = [clip5] + split_block(first, indel & ~in_last)
+    span_first = first + dels * (indel & ~in_last)
+    if n_gaps:
+        for j in range(n_gaps):
+            ops.append('N')
+            slots.append(boundaries[:, 2 * j + 1] - boundaries[:, 2 * j] - 1)
+            if j < n_gaps - 1:
+                ops.append('M')
+                slots.append(inner[:, j])
+        ops.extend(BLOCK_SLOTS)
+        slots.extend(split_block(last, indel & in_last))
+        start = boundaries[:, 0] - span_first + 1
+    else:
+        start = 1 + (rng.random_sample(n) * (lengths[segment] - span_first)).astype(int)
+    ops.append('S')
+    slots.append(clip3)
+    min_block = np.min(np.column_stack([first] + [inner[:, j] for j in range(inner.shape[1])] +
+                                       ([last] if n_gaps else [])), axis=1)
+    return np.column_stack(slots), ops, start, min_block
+
+
+def read_bases(rng, slots, ops, start, offsets, segment, genome, read_length, error_rate):
+    # (n, read_length) uint8 bases: reference bases under M, random bases under S and I, plus substitutions. The
+    # reference index of a read position is its start plus the position, shifted by every D/N before it (up) and every
+    # S/I before it (down); the shifts are added up with a cumulative sum over per-read change points.
+    n = len(start)
+    width = read_length + 1
+    shift = np.zeros(n * width, np.int32)
+    soft = np.zeros(n * width, np.int32)
+    rows = np.arange(n) * width
+    q = np.zeros(n, np.int64)
+    for k, op in enumerate(ops):
+        length = slots[:, k]
+        if op in 'DN':
+            np.add.at(shift, rows + q, length)
+        elif op in 'SI':
+            np.add.at(shift, rows + q + length, -length)
+            np.add.at(soft, rows + q, 1)
+            np.add.at(soft, rows + q + length, -1)
+        if op in 'MSI':
+            q = q + length
+    shift = np.cumsum(shift.reshape(n, width), axis=1)[:, :read_length]
+    from_ref = np.cumsum(soft.reshape(n, width), axis=1)[:, :read_length] == 0
+    ref_index = (start - 1 + offsets[segment])[:, None] + np.arange(read_length)[None, :] + shift
+
+    bases = genome[np.where(from_ref, ref_index, 0)]
+    clipped = ~from_ref
+    bases[clipped] = BASES[rng.randint(0, 4, clipped.sum())]
+    errors = rng.randint(0, bases.size, rng.binomial(bases.size, error_rate))
+    bases.flat[errors] = BASES[rng.randint(0, 4, len(errors))]
+    return bases
+
+
+def join_columns(columns, sep=b'\t'):
+    # the rows of equally long bytes arrays joined into one line each
+    return [sep.join(row) for row in zip(*[column.tolist() for column in columns])]
+
+
+def as_bytes(values):
+    # decimal text of integers; the small numbers that make up most columns are looked up in a table
+    values = np.asarray(values)
+    if values.size and 0 <= values.min() and values.max() < len(NUMBERS):
+        return NUMBERS[values]
+    return values.astype(np.bytes_)
+
+
+def cigar_strings(slots, ops):
+    cigar = np.zeros(len(slots), 'S1')
+    for k, op in enumerate(ops):
+        token = np.char.add(as_bytes(slots[:, k]), op.encode('ascii'))
+        cigar = np.char.add(cigar, np.where(slots[:, k] > 0, token, b''))
+    return cigar
+
+
+def fixed_width(matrix):
+    # rows of a (n, width) uint8 matrix as a bytes array
+    return np.ascontiguousarray(matrix).view('S%i' % matrix.shape[1]).ravel()
+
+
+def simulate_batch(rng, n, first_read, setup, args):
+    names, lengths, offsets, genome, species = setup
+    read_length = args.read_length
+    n_unique = n - int(round(n * args.duplicate_fraction))
+    weights = np.array([1.0 - args.di_fraction] + [args.di_fraction * f / sum(args.gap_fractions)
+                                                   for f in args.gap_fractions])
+    n_gaps = rng.choice(len(weights), n_unique, p=weights / weights.sum())
+
+    columns = dict((key, []) for key in ('segment', 'n_gaps', 'species', 'boundaries', 'min_block', 'cigar',
+                                         'start', 'bases'))
+    for k in range(len(weights)):
+        m = int((n_gaps == k).sum())
+        if not m:
+            continue
+        if k:
+            seg_of, bounds_of, p = species[k]
+            picked = rng.choice(len(p), m, p=p)
+            segment = seg_of[picked]
+            boundaries = bounds_of[picked]
+            boundary_text = np.array(join_columns([as_bytes(boundaries[:, j]) for j in range(2 * k)], b';'))
+        else:
+            picked = np.full(m, -1)
+            segment = rng.choice(len(lengths), m, p=lengths / float(lengths.sum()))
+            boundaries = None
+            boundary_text = np.full(m, b'', 'S1')
+        slots, ops, start, min_block = simulate_layout(rng, m, k, segment, boundaries, lengths, args)
+        columns['segment'].append(segment)
+        columns['n_gaps'].append(np.full(m, k))
+        columns['species'].append(picked)
+        columns['boundaries'].append(boundary_text)
+        columns['min_block'].append(min_block)
+        columns['cigar'].append(cigar_strings(slots, ops))
+        columns['start'].append(start)
+        columns['bases'].append(read_bases(rng, slots, ops, start, offsets, segment, genome, read_length,
+                                           args.error_rate))
+    batch = dict((key, np.concatenate(values)) for key, values in columns.items())
+
+    # duplicates are copies of reads of the same batch, then everything is shuffled
+    source = rng.randint(0, n_unique, n - n_unique)
+    order = np.concatenate([np.arange(n_unique), source])
+    duplicate_of = np.concatenate([np.full(n_unique, -1), source])
+    shuffle = rng.permutation(n)
+    order = order[shuffle]
+    duplicate_of = duplicate_of[shuffle]
+    batch = dict((key, values[order]) for key, values in batch.items())
+    # a duplicate names the read it copies by its position in the shuffled batch
+    position_of = np.empty(n, np.int64)
+    position_of[shuffle] = np.arange(n)
+    batch['duplicate_of'] = np.where(duplicate_of >= 0, position_of[np.maximum(duplicate_of, 0)] + first_read, -1)
+    batch['read_id'] = np.char.add(b'sim', as_bytes(np.arange(first_read, first_read + n)))
+
+    reverse = rng.random_sample(n) < 0.5
+    duplicate = batch['duplicate_of'] >= 0
+    # duplicates keep the strand of their original
+    reverse[duplicate] = reverse[batch['duplicate_of'][duplicate] - first_read]
+    batch['flag'] = np.where(reverse, 16, 0)
+    multimapper = rng.random_sample(n) < args.multimapper_fraction
+    multimapper[duplicate] = multimapper[batch['duplicate_of'][duplicate] - first_read]
+    batch['mapq'] = np.where(multimapper, 3, 255)
+    batch['nh'] = np.where(multimapper, 2, 1)
+    batch['qual'] = QUALITIES[rng.randint(0, len(QUALITIES), (n, read_length))]
+    batch['rname'] = names[batch['segment']]
+    return batch
+
+
+def write_batch(batch, sam, fastq, truth):
+    n = len(batch['read_id'])
+    seq = fixed_width(batch['bases'])
+    qual = fixed_width(batch['qual'])
+    rname = batch['rname']
+    lines = join_columns([
+        batch['read_id'], as_bytes(batch['flag']), rname, as_bytes(batch['start']), as_bytes(batch['mapq']),
+        batch['cigar'], np.full(n, b'*', 'S1'), np.full(n, b'0', 'S1'), np.full(n, b'0', 'S1'), seq, qual,
+        np.char.add(b'NH:i:', as_bytes(batch['nh'])), np.full(n, b'HI:i:1', 'S6')])
+    sam.write(b'\n'.join(lines) + b'\n')
+
+    # fastq holds the reads as sequenced, so reverse-strand alignments are reverse-complemented
+    reverse = batch['flag'] == 16
+    bases = batch['bases'].copy()
+    bases[reverse] = COMPLEMENT[bases[reverse][:, ::-1]]
+    quals = batch['qual'].copy()
+    quals[reverse] = quals[reverse][:, ::-1]
+    records = join_columns([np.char.add(b'@', batch['read_id']), fixed_width(bases), np.full(n, b'+', 'S1'),
+                            fixed_width(quals)], b'\n')
+    fastq.write(b'\n'.join(records) + b'\n')
+
+    duplicate_of = np.where(batch['duplicate_of'] >= 0, np.char.add(b'sim', as_bytes(batch['duplicate_of'])), b'')
+    rows = join_columns([batch['read_id'], rname, as_bytes(batch['n_gaps']), as_bytes(batch['species']),
+                         batch['boundaries'], as_bytes(batch['min_block']), batch['cigar'], as_bytes(batch['mapq']),
+                         duplicate_of], b',')
+    truth.write(b'\n'.join(rows) + b'\n')
+
+
+def main():
+    args = parser.parse_args()
+    rng = np.random.RandomState(args.seed)
+    references = read_fasta(args.reference_genome, read_ids(args.ref))
+    names = np.array([name.encode('ascii') for name, _ in references])
+    lengths = np.array([len(seq) for _, seq in references])
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    genome = np.frombuffer(''.join(seq for _, seq in references).encode('ascii'), np.uint8)
+    species = {}
+    for k in range(1, 5):
+        species[k] = make_species(rng, lengths, k, args.di_species, args.read_length, args.min_anchor,
+                                  args.junction_distribution, args.abundance_sigma)
+    setup = (names, lengths, offsets, genome, species)
+
+    with open(args.output_prefix + '.sam', 'wb') as sam, open(args.output_prefix + '.fastq', 'wb') as fastq, \
+            open(args.output_prefix + '.truth.csv', 'wb') as truth:
+        sam.write(b'@HD\tVN:1.4\tSO:unsorted\n')
+        for name, length in zip(names, lengths):
+            sam.write(b'@SQ\tSN:' + name + ('\tLN:%i\n' % length).encode('ascii'))
+        sam.write(b'@PG\tID:simulate_DI_reads\tPN:simulate_DI_reads.py\n')
+        truth.write((','.join(TRUTH_HEADER) + '\n').encode('ascii'))
+        for first_read in range(0, args.reads, args.batch_size):
+            n = min(args.batch_size, args.reads - first_read)
+            write_batch(simulate_batch(rng, n, first_read, setup, args), sam, fastq, truth)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import collections
+
+# Every stage counts, per input file, the alignments it scanned, parsed (CIGAR decoded) and kept in a Counter. Any other
+# key of the Counter is the reason an alignment was dropped:
+#   off_target_contig       not on one of the wanted reference sequences
+#   mapq_not_255            not a unique STAR alignment
+#   duplicate               a duplicate of a read or read pair with the same unclipped 5' ends
+#   no_gap                  no N in the CIGAR
+#   pattern_not_handled     a CIGAR pattern the stage does not take
+#   outside_cds             not inside the coding region of its segment
+#   below_min_length        an M block shorter than --min_length
+#   below_skip_length       an N gap shorter than --skip_length
+#   gap_count_not_reported  a number of gaps that is not written out
+TOTALS = ('scanned', 'parsed', 'kept')
+
+
+def count_alignments(alignments, counts, key):
+    # passes the stream on unchanged, counting its alignments under key
+    for line, split_line in alignments:
+        if split_line is not None:
+            counts[key] += 1
+        yield line, split_line
+
+
+def file_entry(path, counts, seconds):
+    size = os.path.getsize(path)
+    return {
+        'file': path,
+        'bytes': size,
+        'seconds': round(seconds, 3),
+        'bytes_per_s': round(size / seconds, 1) if seconds else None,
+        'scanned': counts['scanned'],
+        'parsed': counts['parsed'],
+        'kept': counts['kept'],
+        'rejected': dict((k, v) for k, v in counts.items() if k not in TOTALS),
+    }
+
+
+class StageMetrics(object):
+    # collects the per-file counts of one run of a stage and writes them, with the totals, as a JSON sidecar
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.files = []
+        self.counts = collections.Counter()
+        self.start = time.time()
+
+    def add_file(self, path, counts, seconds):
+        self.files.append(file_entry(path, counts, seconds))
+        self.counts.update(counts)
+
+    def track(self, processed):
+        # for process_files() of the boundary engine: takes the metrics off the (sid, records, metrics) it yields
+        for sid, records, (path, counts, seconds) in processed:
+            self.add_file(path, counts, seconds)
+            yield sid, records
+
+    def write(self, path):
+        wall = time.time() - self.start
+        size = sum(entry['bytes'] for entry in self.files)
+        summary = {
+            'stage': self.stage,
+            'seconds': round(wall, 3),
+            'bytes': size,
+            'bytes_per_s': round(size / wall, 1) if wall else None,
+            'scanned': self.counts['scanned'],
+            'parsed': self.counts['parsed'],
+            'kept': self.counts['kept'],
+            'rejected': dict((k, v) for k, v in self.counts.items() if k not in TOTALS),
+            'files': self.files,
+        }
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+            f.write('\n')
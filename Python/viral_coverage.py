@@ -0,0 +1,148 @@
+import os
+import argparse
+import multiprocessing
+import numpy as np
+from alignment_io import iter_alignment_file
+from pipeline_stages import read_fasta_lengths
+from cigar_arrays import COVERING, decode_cigars, read_index, operator_positions
+
+parser = argparse.ArgumentParser('Per-base depth of every viral segment in every sample, counted like bedtools genomecov -d -split: every alignment adds one to the reference bases of its M, =, X and D operators, and N gaps are skipped. All samples go into one samples x segments x positions int32 array (<output>.npy, memory-mapped by np.load(..., mmap_mode=\'r\')) with the sample names in <output>.samples.txt and the segment names and lengths in <output>.segments.txt; depth[sample, segment, p - 1] is the depth at position p, and positions past the end of a segment are 0.')
+
+parser.add_argument(
+    'files', nargs='+', help='input sam or bam file for each cell (e.g., 7_py_IAV_sam_qualfiltered/*.sam)')
+parser.add_argument(
+    '-g', '--reference_genome', required=True, help='IAV reference genomes in fasta format; the segments and their lengths are taken from it')
+parser.add_argument(
+    '-o', '--output', required=True, help='the output name without extension')
+parser.add_argument(
+    '-j', '--jobs', type=int, default=1, help='the number of input files processed in parallel (default: 1)')
+
+DEPTH = np.dtype('int32')
+
+# alignments whose CIGARs are decoded together
+BATCH_SIZE = 4096
+
+UNMAPPED = 0x4
+
+
+class Coverage(object):
+    # per-base depth of a list of (segment, length), accumulated as one difference array over all segments. Every
+    # segment has a row of the longest length plus one, so that ends past a segment are cut off at that last column.
+
+    def __init__(self, segments):
+        self.names = [name for name, _ in segments]
+        self.lengths = [length for _, length in segments]
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.width = max(length for _, length in segments) + 1
+        self._diff = np.zeros(len(segments) * self.width, np.int64)
+        self._rows = []
+        self._positions = []
+        self._cigars = []
+
+    def add(self, split_line):
+        if split_line[2] not in self.index or split_line[5] == '*' or int(split_line[1]) & UNMAPPED:
+            return
+        self._rows.append(self.index[split_line[2]])
+        self._positions.append(int(split_line[3]))
+        self._cigars.append(split_line[5])
+        if len(self._cigars) == BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._cigars:
+            return
+        codes, lens, offsets = decode_cigars(self._cigars)
+        read = read_index(offsets)
+        # 0-based start of every operator on the reference
+        start = operator_positions(codes, lens, offsets, np.array(self._positions, np.int64), read) - 1
+        covering = COVERING[codes]
+        start = start[covering]
+        end = start + lens[covering]
+        base = np.array(self._rows, np.int64)[read[covering]] * self.width
+        last = self.width - 1
+        size = len(self._diff)
+        self._diff += np.bincount(base + np.clip(start, 0, last), minlength=size)
+        self._diff -= np.bincount(base + np.clip(end, 0, last), minlength=size)
+        self._rows, self._positions, self._cigars = [], [], []
+
+    def depth(self):
+        # segments x positions; bases of reads hanging over the end of a segment are not counted
+        self._flush()
+        depth = np.cumsum(self._diff.reshape(-1, self.width), axis=1)[:, :-1].astype(DEPTH)
+        for row, length in enumerate(self.lengths):
+            depth[row, length:] = 0
+        return depth
+
+
+def count_coverage(alignments, coverage):
+    # passes the stream on unchanged while adding every alignment to a Coverage
+    for line, split_line in alignments:
+        if split_line is not None:
+            coverage.add(split_line)
+        yield line, split_line
+
+
+def file_depth(file_, segments):
+    coverage = Coverage(segments)
+    for _, split_line in iter_alignment_file(file_):
+        if split_line is not None:
+            coverage.add(split_line)
+    return coverage.depth()
+
+
+def create_depth(path, samples, segments):
+    # the zero-filled <path>.npy and its index files, ready for write_depth()
+    with open(path + '.samples.txt', 'w') as f:
+        f.writelines(sid + '\n' for sid in samples)
+    with open(path + '.segments.txt', 'w') as f:
+        f.writelines('%s\t%i\n' % segment for segment in segments)
+    shape = (len(samples), len(segments), max(length for _, length in segments))
+    depths = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=DEPTH, shape=shape)
+    del depths
+
+
+def write_depth(path, row, depth):
+    # the depth of one sample into <path>.npy; rows of different samples can be written from different processes
+    depths = np.load(path + '.npy', mmap_mode='r+')
+    depths[row] = depth
+    depths.flush()
+    del depths
+
+
+def load_depth(path, mmap_mode='r'):
+    # the depth array, the sample names and the (segment, length) list
+    with open(path + '.samples.txt') as f:
+        samples = [line.rstrip('\n') for line in f]
+    with open(path + '.segments.txt') as f:
+        segments = [(name, int(length)) for name, length in (line.rstrip('\n').split('\t') for line in f)]
+    return np.load(path + '.npy', mmap_mode=mmap_mode), samples, segments
+
+
+def sample_id(file_):
+    return os.path.basename(file_).split('.')[0]
+
+
+def main():
+    args = parser.parse_args()
+    segments = read_fasta_lengths(args.reference_genome)
+    create_depth(args.output, [sample_id(file_) for file_ in args.files], segments)
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        try:
+            pending = [pool.apply_async(file_depth, (file_, segments)) for file_ in args.files]
+            for row, result in enumerate(pending):
+                write_depth(args.output, row, result.get())
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        for row, file_ in enumerate(args.files):
+            print('Processing file: ' + file_)
+            write_depth(args.output, row, file_depth(file_, segments))
+
+
+if __name__ == '__main__':
+    main()
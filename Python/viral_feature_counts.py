@@ -0,0 +1,274 @@
+import os
+import re
+import sys
+import bisect
+import argparse
+import collections
+import multiprocessing
+from alignment_io import iter_alignment_file, SAM_FIELDS
+
+parser = argparse.ArgumentParser('Count read pairs per gene like featureCounts -p -B -C -t exon -g gene_id: a fragment is assigned to the one gene whose exons overlap an aligned base of either end by at least one base, on either strand. Pairs need both ends mapped to the same segment on opposite strands, and primary alignments with NH above 1 are not counted; reads that are not paired are counted on their own. Writes <output> in the featureCounts layout (Geneid, Chr, Start, End, Strand, Length, then one column per input file) and <output>.summary.')
+
+parser.add_argument(
+    'files', nargs='+', help='input sam or bam file for each cell (e.g., 7_py_dedup_sam/*.sam)')
+parser.add_argument(
+    '-a', '--annotation', required=True, help='gene annotation in GTF format (e.g., H1N1_PR8_8segs_genes_annotation_full_02032020.gtf)')
+parser.add_argument(
+    '-o', '--output', required=True, help='the output count table (e.g., featureCounts.txt)')
+parser.add_argument(
+    '-j', '--jobs', type=int, default=1, help='the number of input files processed in parallel (default: 1)')
+
+GENE_ID = re.compile(r'gene_id "([^"]*)"')
+CIGAR = re.compile(r'(\d+)([MIDNSHP=X])')
+ALIGNED = frozenset('M=X')
+REF_CONSUMING = frozenset('MDN=X')
+
+PAIRED = 0x1
+UNMAPPED = 0x4
+MATE_UNMAPPED = 0x8
+REVERSE = 0x10
+FIRST_IN_PAIR = 0x40
+NOT_PRIMARY = 0x100 | 0x800
+
+# the rows of a featureCounts (1.5) summary
+STATUSES = ('Assigned', 'Unassigned_Ambiguity', 'Unassigned_MultiMapping', 'Unassigned_NoFeatures',
+            'Unassigned_Unmapped', 'Unassigned_MappingQuality', 'Unassigned_FragmentLength', 'Unassigned_Chimera',
+            'Unassigned_Secondary', 'Unassigned_Nonjunction', 'Unassigned_Duplicate')
+
+
+def read_gtf(path, feature='exon'):
+    # the gene_ids in the order they first come up, and (gene index, segment, start, end, strand) of every exon
+    genes = []
+    index = {}
+    exons = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            split_line = line.rstrip('\r\n').split('\t')
+            if len(split_line) < 9 or split_line[2] != feature:
+                continue
+            gene_id = GENE_ID.search(split_line[8])
+            if not gene_id:
+                continue
+            if gene_id.group(1) not in index:
+                index[gene_id.group(1)] = len(genes)
+                genes.append(gene_id.group(1))
+            exons.append((index[gene_id.group(1)], split_line[0], int(split_line[3]), int(split_line[4]),
+                          split_line[6]))
+    return genes, exons
+
+
+class FeatureIndex(object):
+    # the exons of every segment sorted by start; an exon overlapping [start, end] starts at most the longest exon
+    # length before start, so a lookup walks back from the last exon starting before end until then
+
+    def __init__(self, genes, exons):
+        self.genes = genes
+        self.exons = exons
+        by_segment = collections.defaultdict(list)
+        for gene, segment, start, end, _ in exons:
+            by_segment[segment].append((start, end, gene))
+        self._exons = {}
+        self._starts = {}
+        self._longest = {}
+        for segment, segment_exons in by_segment.items():
+            segment_exons.sort()
+            self._exons[segment] = segment_exons
+            self._starts[segment] = [start for start, _, _ in segment_exons]
+            self._longest[segment] = max(end - start + 1 for start, end, _ in segment_exons)
+
+    def overlapping(self, segment, start, end, genes):
+        # adds the genes with an exon overlapping [start, end] to the set genes
+        if segment not in self._exons:
+            return
+        exons = self._exons[segment]
+        first = start - self._longest[segment]
+        i = bisect.bisect_right(self._starts[segment], end)
+        while i > 0:
+            i -= 1
+            exon_start, exon_end, gene = exons[i]
+            if exon_start < first:
+                break
+            if exon_end >= start:
+                genes.add(gene)
+
+
+def aligned_blocks(position, cigar):
+    # the [start, end] reference ranges of the aligned bases; N gaps and deletions are not counted
+    blocks = []
+    for n, op in CIGAR.findall(cigar):
+        n = int(n)
+        if op in ALIGNED:
+            blocks.append((position, position + n - 1))
+        if op in REF_CONSUMING:
+            position += n
+    return blocks
+
+
+def hit_count(line, split_line):
+    # the NH tag of an alignment, 1 if it has none
+    if len(split_line) > SAM_FIELDS:
+        rest = split_line[SAM_FIELDS]
+    else:
+        rest = str(line).split('\t', SAM_FIELDS)[SAM_FIELDS]
+    i = rest.find('\tNH:i:')
+    if i < 0:
+        return 1
+    return int(rest[i + 6:].split('\t', 1)[0])
+
+
+class FeatureCounts(object):
+    # gene counts and summary of one sample. Both ends of a pair are needed to assign it, so the first end to come is
+    # held by QNAME until its mate does; an end whose mate never comes leaves its fragment unmapped, as with -B.
+
+    def __init__(self, index):
+        self.index = index
+        self.counts = [0] * len(index.genes)
+        self.status = collections.Counter()
+        self._mates = {}
+
+    def add(self, line, split_line):
+        flag = int(split_line[1])
+        if flag & NOT_PRIMARY:
+            return
+        if not flag & PAIRED:
+            if flag & UNMAPPED:
+                self.status['Unassigned_Unmapped'] += 1
+            else:
+                self._assign([self._end(line, split_line, flag)])
+            return
+        if flag & UNMAPPED:
+            # the fragment is counted with the mapped mate, or here once if neither end is mapped
+            if flag & MATE_UNMAPPED and flag & FIRST_IN_PAIR:
+                self.status['Unassigned_Unmapped'] += 1
+            return
+        if flag & MATE_UNMAPPED:
+            self.status['Unassigned_Unmapped'] += 1
+            return
+        qname = split_line[0]
+        if qname not in self._mates:
+            self._mates[qname] = self._end(line, split_line, flag)
+            return
+        self._assign([self._mates.pop(qname), self._end(line, split_line, flag)])
+
+    def _end(self, line, split_line, flag):
+        return (split_line[2], bool(flag & REVERSE), aligned_blocks(int(split_line[3]), split_line[5]),
+                hit_count(line, split_line))
+
+    def _assign(self, ends):
+        if any(nh > 1 for _, _, _, nh in ends):
+            self.status['Unassigned_MultiMapping'] += 1
+            return
+        if len(ends) == 2 and (ends[0][0] != ends[1][0] or ends[0][1] == ends[1][1]):
+            # -C: the ends of a pair on different segments, or on the same strand
+            self.status['Unassigned_Chimera'] += 1
+            return
+        genes = set()
+        for segment, _, blocks, _ in ends:
+            for start, end in blocks:
+                self.index.overlapping(segment, start, end, genes)
+        if not genes:
+            self.status['Unassigned_NoFeatures'] += 1
+        elif len(genes) > 1:
+            self.status['Unassigned_Ambiguity'] += 1
+        else:
+            self.counts[genes.pop()] += 1
+            self.status['Assigned'] += 1
+
+    def column(self):
+        # the gene counts followed by the summary, in STATUSES order
+        self.status['Unassigned_Unmapped'] += len(self._mates)
+        self._mates = {}
+        return self.counts + [self.status[status] for status in STATUSES]
+
+
+def count_features(alignments, feature_counts):
+    # passes the stream on unchanged while adding every alignment to a FeatureCounts
+    for line, split_line in alignments:
+        if split_line is not None:
+            feature_counts.add(line, split_line)
+        yield line, split_line
+
+
+def file_column(file_, index):
+    feature_counts = FeatureCounts(index)
+    for line, split_line in iter_alignment_file(file_):
+        if split_line is not None:
+            feature_counts.add(line, split_line)
+    return feature_counts.column()
+
+
+def merged_length(exons):
+    # the number of bases covered by any of the (start, end) exons
+    length = 0
+    last = 0
+    for start, end in sorted(exons):
+        if end > last:
+            length += end - max(start, last + 1) + 1
+            last = end
+    return length
+
+
+def write_feature_counts(path, index, files, columns, command=None):
+    # <path> and <path>.summary in the layout of featureCounts; columns are those of FeatureCounts.column(), in the
+    # order of files
+    n_genes = len(index.genes)
+    exons = [[] for _ in index.genes]
+    for gene, segment, start, end, strand in index.exons:
+        exons[gene].append((segment, start, end, strand))
+    with open(path, 'w') as f:
+        f.write('# Program:viral_feature_counts.py; Command:%s\n' % ' '.join('"%s"' % arg for arg in command or sys.argv))
+        f.write('\t'.join(['Geneid', 'Chr', 'Start', 'End', 'Strand', 'Length'] + list(files)) + '\n')
+        for gene, gene_id in enumerate(index.genes):
+            fields = [gene_id] + [';'.join(str(exon[k]) for exon in exons[gene]) for k in range(4)]
+            fields.append(str(merged_length((start, end) for _, start, end, _ in exons[gene])))
+            f.write('\t'.join(fields + [str(column[gene]) for column in columns]) + '\n')
+    with open(path + '.summary', 'w') as f:
+        f.write('\t'.join(['Status'] + list(files)) + '\n')
+        for k, status in enumerate(STATUSES):
+            f.write('\t'.join([status] + [str(column[n_genes + k]) for column in columns]) + '\n')
+
+
+def write_part(path, row, column):
+    # the column of one sample next to <path>, for read_parts(); columns of different samples can be written from
+    # different processes
+    with open('%s.%i.part' % (path, row), 'w') as f:
+        f.writelines('%i\n' % count for count in column)
+
+
+def read_parts(path, n_rows):
+    # the columns written by write_part(), whose files are removed
+    columns = []
+    for row in range(n_rows):
+        part = '%s.%i.part' % (path, row)
+        with open(part) as f:
+            columns.append([int(count) for count in f])
+        os.remove(part)
+    return columns
+
+
+def main():
+    args = parser.parse_args()
+    index = FeatureIndex(*read_gtf(args.annotation))
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        try:
+            pending = [pool.apply_async(file_column, (file_, index)) for file_ in args.files]
+            columns = [result.get() for result in pending]
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        columns = []
+        for file_ in args.files:
+            print('Processing file: ' + file_)
+            columns.append(file_column(file_, index))
+    write_feature_counts(args.output, index, args.files, columns)
+
+
+if __name__ == '__main__':
+    main()